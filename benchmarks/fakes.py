@@ -0,0 +1,167 @@
+"""In-memory stand-ins for the Bot API and a worksheet, for offline runs."""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import requests
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+from telegram.request import BaseRequest
+
+
+def quota_error():
+    """The ``APIError`` gspread raises when Sheets answers 429."""
+    response = requests.Response()
+    response.status_code = 429
+    error = {
+        "code": 429,
+        "message": "Quota exceeded for quota metric 'Read requests'",
+        "status": "RESOURCE_EXHAUSTED",
+    }
+    response._content = json.dumps({"error": error}).encode()
+    return APIError(response)
+
+
+class Cell:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeWorksheet:
+    """Just enough of ``gspread.Worksheet`` for the bot, kept in a list.
+
+    Every call sleeps ``latency`` seconds (it runs in a worker thread, like
+    the real thing) and is counted in ``calls``. A share ``error_rate`` of the
+    calls fails with a 429 quota error instead; those are counted in
+    ``errors``. It doubles as its own spreadsheet for ``get_lastUpdateTime``.
+    With ``ids`` the gifts come with fixed ids instead of getting random ones
+    from the bot.
+    """
+
+    HEADER = ["id", "gift_name", "price", "link", "status", "log", "booker", "gift_id"]
+
+    def __init__(self, gifts=50, latency=0.0, error_rate=0.0, seed=None, ids=False):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self.spreadsheet = self
+        self.modified = time.time()
+        self.rows = [list(self.HEADER)] + [
+            [str(i), f"Gift {i}", str(100 * i), f"https://example.com/{i}"]
+            for i in range(1, gifts + 1)
+        ]
+        if ids:
+            # Fixed ids, so separate processes agree on them
+            for i, row in enumerate(self.rows[1:], start=1):
+                row.extend(["", "", "", f"gift{i:04d}"])
+
+    def _call(self, method):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[method] += 1
+            raise quota_error()
+
+    def get_lastUpdateTime(self):
+        self._call("get_lastUpdateTime")
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.modified))
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row):
+        self._call("row_values")
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        self._call("col_values")
+        values = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+        # Like gspread, without the empty cells at the bottom
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def cell(self, row, col):
+        self._call("cell")
+        values = self.rows[row - 1] if row <= len(self.rows) else []
+        return Cell(values[col - 1] if len(values) >= col else "")
+
+    def batch_update(self, data):
+        self._call("batch_update")
+        self.modified = time.time()
+        for update in data:
+            row, col = a1_to_rowcol(update["range"].split(":")[0])
+            while len(self.rows) < row:
+                self.rows.append([])
+            values = self.rows[row - 1]
+            new = update["values"][0]
+            first, last = col - 1, col - 1 + len(new)
+            values.extend([""] * (last - len(values)))
+            values[first:last] = new
+
+    def append_rows(self, values, value_input_option=None):
+        self._call("append_rows")
+        self.modified = time.time()
+        self.rows.extend(list(row) for row in values)
+
+
+class FakeRequest(BaseRequest):
+    """Answers Bot API calls locally and counts them per endpoint.
+
+    The last message sent to or edited in each chat is kept in ``replies``
+    (as the request parameters), so a simulated user can press its buttons.
+    """
+
+    BOT = {"id": 1, "is_bot": True, "first_name": "Wishlist", "username": "bot"}
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.replies = {}
+        self.answers = {}  # inline query id -> answerInlineQuery parameters
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return (
+            200,
+            json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode(),
+        )
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return self.BOT
+        if endpoint == "answerInlineQuery":
+            self.answers[params["inline_query_id"]] = params
+        if endpoint in ("sendMessage", "editMessageText"):
+            self.replies[int(params.get("chat_id", 1))] = params
+            self._message_id += 1
+            return {
+                "message_id": params.get("message_id", self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+                "from": self.BOT,
+                "text": params.get("text", ""),
+            }
+        return True
@@ -0,0 +1,231 @@
+"""Replay simulated users through the bot's handlers against fake backends.
+
+Run from the repository root::
+
+    python -m benchmarks.load --users 50 --rounds 3
+    python -m benchmarks.load --sheets-latency 0.2 --quota-errors 0.05
+    python -m benchmarks.load --backend sqlite
+
+Each user opens /free, books a random free gift, confirms, opens
+/my_booked and removes the booking again. Every update goes through the
+real application (handlers, store, cache and rate limiter) while Telegram
+and the spreadsheet are in-memory fakes. The report lists throughput,
+latency percentiles per action and API calls per action.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+from benchmarks.fakes import FakeRequest, FakeWorksheet
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def command(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def button(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "from": user(user_id),
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
+
+
+def buttons(request, chat_id, prefix):
+    """Callback data of the buttons starting with ``prefix`` in the last reply."""
+    markup = request.replies.get(chat_id, {}).get("reply_markup") or {}
+    return [
+        key["callback_data"]
+        for row in markup.get("inline_keyboard", [])
+        for key in row
+        if key.get("callback_data", "").startswith(prefix)
+    ]
+
+
+class LoadTest:
+    def __init__(self, app, request, rounds, seed):
+        self.app = app
+        self.request = request
+        self.rounds = rounds
+        self.random = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.update_id = 0
+
+    async def send(self, action, payload):
+        self.update_id += 1
+        update = Update.de_json(payload(self.update_id), self.app.bot)
+        started = time.perf_counter()
+        await self.app.process_update(update)
+        self.latencies[action].append(time.perf_counter() - started)
+
+    async def press(self, action, user_id, prefix):
+        choices = buttons(self.request, user_id, prefix)
+        if not choices:
+            return False
+        data = self.random.choice(choices)
+        await self.send(action, lambda i: button(i, user_id, data))
+        return True
+
+    async def session(self, user_id):
+        for _ in range(self.rounds):
+            await self.send("/free", lambda i: command(i, user_id, "/free"))
+            if not await self.press("book", user_id, "book|"):
+                continue
+            if not await self.press("confirm", user_id, "confirm|"):
+                continue
+            await self.send("/my_booked", lambda i: command(i, user_id, "/my_booked"))
+            if not await self.press("remove", user_id, "remove|"):
+                continue
+            await self.press("remove_confirm", user_id, "remove_confirm|")
+
+    async def run(self, users):
+        await asyncio.gather(*(self.session(1000 + n) for n in range(users)))
+
+
+def percentile(samples, q):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+async def main(args):
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("SYNC_INTERVAL", "1")
+    os.environ["SHEETS_QUOTA_PER_MINUTE"] = str(args.sheets_quota)
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["SQLITE_PATH"] = os.path.join(workdir.name, "load.db")
+
+    import bot
+    from metrics import HANDLER_ERRORS
+    from ratelimit import FloodControlLimiter
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Failed handlers are counted in the report instead
+    logging.getLogger("telegram.ext.Application").setLevel(logging.CRITICAL)
+
+    worksheet = FakeWorksheet(
+        gifts=args.gifts,
+        latency=args.sheets_latency,
+        error_rate=args.quota_errors,
+        seed=args.seed,
+    )
+
+    async def open_sheet(name):
+        return worksheet
+
+    bot.open_sheet = open_sheet
+    log_sheet = FakeWorksheet(gifts=0)
+
+    async def open_log_sheet(name):
+        return log_sheet
+
+    bot.open_log_sheet = open_log_sheet
+    if not args.telegram_limits:
+        # Measure the bot, not Telegram's one-message-a-second chat limit
+        bot.rate_limiter = FloodControlLimiter(
+            overall_rate=10**6, chat_rate=10**6, chat_burst=10**6
+        )
+    request = FakeRequest(latency=args.telegram_latency)
+    app = bot.build_application(
+        ApplicationBuilder()
+        .token("123:benchmark")
+        .request(request)
+        .get_updates_request(FakeRequest())
+    )
+    await app.initialize()
+    await app.post_init(app)
+    await bot.wishlists.get(bot.SPREADSHEET_NAME).warm_up_task
+    worksheet.calls.clear()
+    request.calls.clear()
+
+    test = LoadTest(app, request, args.rounds, args.seed)
+    started = time.perf_counter()
+    await test.run(args.users)
+    elapsed = time.perf_counter() - started
+
+    await app.post_stop(app)
+    await app.shutdown()
+    bot.sheets_executor.shutdown()
+    workdir.cleanup()
+
+    updates = sum(len(samples) for samples in test.latencies.values())
+    telegram_calls = sum(request.calls.values())
+    sheets_calls = sum(worksheet.calls.values())
+    errors = HANDLER_ERRORS.total()
+
+    print(f"{args.users} users x {args.rounds} rounds, backend {args.backend}")
+    print(f"updates:     {updates} in {elapsed:.2f}s ({updates / elapsed:.1f}/s)")
+    print(
+        f"errors:      {errors:g} handler errors, {sum(worksheet.errors.values())} quota errors"
+    )
+    print()
+    print(f"{'action':<16}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for action, samples in test.latencies.items():
+        p50, p95, p99 = (1000 * percentile(samples, q) for q in (50, 95, 99))
+        print(f"{action:<16}{len(samples):>7}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}")
+    print()
+    print(f"Bot API calls per action: {telegram_calls / updates:.2f}")
+    for endpoint, count in request.calls.most_common():
+        print(f"  {endpoint:<22}{count:>7}")
+    print(f"Sheets calls per action:  {sheets_calls / updates:.2f}")
+    for method, count in worksheet.calls.most_common():
+        print(f"  {method:<22}{count:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--gifts", type=int, default=100)
+    parser.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--quota-errors", type=float, default=0.0)
+    parser.add_argument(
+        "--sheets-quota",
+        type=int,
+        default=0,
+        help="per-wishlist Sheets calls per minute (default: unlimited)",
+    )
+    parser.add_argument(
+        "--telegram-limits",
+        action="store_true",
+        help="keep the production per-chat and global Bot API limits",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""Time inline-mode gift search through the bot's handlers.
+
+Run from the repository root::
+
+    python -m benchmarks.search --gifts 1000 --users 20
+    python -m benchmarks.search --gifts 5000 --sheets-latency 0.2
+
+The fake spreadsheet gets gifts named from a small vocabulary, so queries
+match many of them. After the wishlist has warmed up, every user types a
+few words letter by letter, and each keystroke is sent as an inline query
+through the real application. The report shows latency percentiles per
+query, results per answer and how many Sheets calls the queries made
+(there should be none).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+from benchmarks.fakes import FakeRequest, FakeWorksheet
+from benchmarks.load import percentile, user
+
+WORDS = (
+    "lego набір книга настільна гра чашка плед навушники рюкзак кеди пазл "
+    "ліхтарик термос свічка блокнот ручка колонка годинник шарф рукавички"
+).split()
+
+
+def inline_query(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": user(user_id),
+            "query": text,
+            "offset": "",
+        },
+    }
+
+
+async def main(args):
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("CHANGE_POLL_INTERVAL", "0")
+    os.environ["SHEETS_QUOTA_PER_MINUTE"] = "0"
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["SQLITE_PATH"] = os.path.join(workdir.name, "search.db")
+
+    import bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    worksheet = FakeWorksheet(gifts=args.gifts, latency=args.sheets_latency)
+    for row in worksheet.rows[1:]:
+        row[1] = " ".join(rng.sample(WORDS, 3)).capitalize()
+
+    async def open_sheet(name):
+        return worksheet
+
+    bot.open_sheet = open_sheet
+    request = FakeRequest()
+    app = bot.build_application(
+        ApplicationBuilder()
+        .token("123:benchmark")
+        .request(request)
+        .get_updates_request(FakeRequest())
+    )
+    await app.initialize()
+    await app.post_init(app)
+    await bot.wishlists.get(bot.SPREADSHEET_NAME).warm_up_task
+    warm_calls = sum(worksheet.calls.values())
+
+    latencies, results = [], []
+    update_id = 0
+
+    async def session(user_id):
+        nonlocal update_id
+        text = ""
+        for word in rng.sample(WORDS, args.words):
+            text = f"{text} ".lstrip()
+            for letter in word:
+                text += letter
+                update_id += 1
+                payload = inline_query(update_id, user_id, text)
+                started = time.perf_counter()
+                await app.process_update(Update.de_json(payload, app.bot))
+                latencies.append(time.perf_counter() - started)
+                results.append(len(request.answers[str(update_id)]["results"]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(1000 + n) for n in range(args.users)))
+    elapsed = time.perf_counter() - started
+    sheets_calls = sum(worksheet.calls.values()) - warm_calls
+
+    await app.post_stop(app)
+    await app.shutdown()
+    bot.sheets_executor.shutdown()
+    workdir.cleanup()
+
+    p50, p95, p99 = (1000 * percentile(latencies, q) for q in (50, 95, 99))
+    print(f"{args.gifts} gifts, {args.users} users typing {args.words} words")
+    print(f"queries:      {len(latencies)} in {elapsed:.2f}s")
+    print(f"latency ms:   p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}")
+    print(f"results:      {statistics.mean(results):.1f} per answer on average")
+    print(f"sheets calls: {sheets_calls}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gifts", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--words", type=int, default=2)
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
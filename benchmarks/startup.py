@@ -0,0 +1,84 @@
+"""Time from process start to the first answered webhook update.
+
+Run from the repository root::
+
+    python -m benchmarks.startup --auth-latency 2.5
+    python -m benchmarks.startup --auth-latency 2.5 --eager
+
+Google authorisation is simulated with ``--auth-latency`` seconds of delay;
+``--eager`` waits for it before serving, as the bot did before the Sheets
+client became lazy.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+STARTED = time.perf_counter()
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+
+from benchmarks.fakes import FakeRequest, FakeWorksheet  # noqa: E402
+
+START_UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+async def main(auth_latency, eager):
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("PERSISTENCE_PATH", "")
+    os.environ.setdefault("JOURNAL_SHEET", "")
+    import bot
+
+    imported = time.perf_counter()
+
+    async def open_sheet(name):
+        await asyncio.sleep(auth_latency)
+        return FakeWorksheet()
+
+    bot.open_sheet = open_sheet
+    request = FakeRequest()
+    app = bot.build_application(
+        ApplicationBuilder()
+        .token("123:benchmark")
+        .request(request)
+        .get_updates_request(FakeRequest())
+    )
+    await app.initialize()
+    await app.post_init(app)
+    wishlist = bot.wishlists.get(bot.SPREADSHEET_NAME)
+    if eager:
+        await wishlist.warm_up_task
+    ready = time.perf_counter()
+
+    await app.process_update(Update.de_json(START_UPDATE, app.bot))
+    answered = time.perf_counter()
+
+    await wishlist.warm_up_task
+    warm = time.perf_counter()
+    await app.post_stop(app)
+    await app.shutdown()
+
+    print(f"import bot:              {imported - STARTED:7.3f}s")
+    print(f"initialise + post_init:  {ready - imported:7.3f}s")
+    print(f"first webhook response:  {answered - STARTED:7.3f}s after start")
+    print(f"sheet cache warm:        {warm - STARTED:7.3f}s after start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--auth-latency", type=float, default=2.0)
+    parser.add_argument("--eager", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.auth_latency, args.eager))
@@ -0,0 +1,164 @@
+"""Run several bot processes on shared state and check nothing is double-booked.
+
+Run from the repository root::
+
+    python -m benchmarks.workers --workers 1 2 4
+    python -m benchmarks.workers --workers 4 --gifts 5 --users 50
+
+For each worker count, that many processes start the real application with
+STORAGE_BACKEND=sqlite and SHARED_STATE_PATH pointing at the same files.
+Each process gets its own fake Telegram and fake spreadsheet. Users in every
+process keep grabbing gifts from one small hot set and releasing them. At the
+end, each gift's events in the booking journal must alternate between a booking and its
+release by the same user. The report shows total throughput per worker count.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.load import button
+
+
+def worker(index, args, workdir, barrier, results):
+    os.environ.update(
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=os.path.join(workdir, "wishlist.db"),
+        SHARED_STATE_PATH=os.path.join(workdir, "shared.db"),
+        METRICS_PORT="0",
+        CHANGE_POLL_INTERVAL="0",
+        SHEETS_QUOTA_PER_MINUTE="0",
+        JOURNAL_SHEET="",
+    )
+    results.put(asyncio.run(serve(index, args, barrier)))
+
+
+async def serve(index, args, barrier):
+    import logging
+
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+
+    import bot
+    from benchmarks.fakes import FakeRequest, FakeWorksheet
+    from ratelimit import FloodControlLimiter
+
+    logging.getLogger().setLevel(logging.WARNING)
+    worksheet = FakeWorksheet(gifts=args.gifts, latency=args.sheets_latency, ids=True)
+
+    async def open_sheet(name):
+        return worksheet
+
+    bot.open_sheet = open_sheet
+    bot.rate_limiter = FloodControlLimiter(
+        overall_rate=10**6, chat_rate=10**6, chat_burst=10**6
+    )
+    request = FakeRequest(latency=args.telegram_latency)
+    app = bot.build_application(
+        ApplicationBuilder()
+        .token("123:benchmark")
+        .request(request)
+        .get_updates_request(FakeRequest())
+    )
+    await app.initialize()
+    await app.post_init(app)
+    await bot.wishlists.get(bot.SPREADSHEET_NAME).warm_up_task
+    await asyncio.to_thread(barrier.wait)
+
+    rng = random.Random(index)
+    gift_ids = [f"gift{i:04d}" for i in range(1, args.gifts + 1)]
+    update_id = index * 10**7
+    booked = 0
+
+    async def press(user_id, data):
+        nonlocal update_id
+        update_id += 1
+        payload = button(update_id, user_id, data)
+        await app.process_update(Update.de_json(payload, app.bot))
+        return request.replies[user_id]["text"]
+
+    async def session(user_id):
+        nonlocal booked
+        for _ in range(args.rounds):
+            gift_id = rng.choice(gift_ids)
+            if (await press(user_id, f"confirm|{gift_id}")).startswith("✅"):
+                booked += 1
+                await press(user_id, f"unbook|{gift_id}")
+
+    first_user = (index + 1) * 100000
+    started = time.perf_counter()
+    await asyncio.gather(*(session(first_user + n) for n in range(args.users)))
+    elapsed = time.perf_counter() - started
+    updates = update_id - index * 10**7
+
+    await app.post_stop(app)
+    await app.shutdown()
+    bot.sheets_executor.shutdown()
+    return {"updates": updates, "elapsed": elapsed, "booked": booked}
+
+
+def double_bookings(path):
+    """Gifts whose journal shows a booking while someone else held them."""
+    conn = sqlite3.connect(path)
+    holders, broken = {}, set()
+    events = conn.execute("SELECT gift_id, action, user_id FROM events ORDER BY id")
+    for gift_id, action, user_id in events:
+        holder = holders.get(gift_id)
+        if action == "book":
+            if holder is not None:
+                broken.add(gift_id)
+            holders[gift_id] = user_id
+        else:
+            if holder != user_id:
+                broken.add(gift_id)
+            holders[gift_id] = None
+    conn.close()
+    return sorted(broken)
+
+
+def run(count, args):
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        barrier = context.Barrier(count)
+        results = context.Queue()
+        processes = [
+            context.Process(target=worker, args=(i, args, workdir, barrier, results))
+            for i in range(count)
+        ]
+        for process in processes:
+            process.start()
+        stats = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        broken = double_bookings(os.path.join(workdir, "wishlist.db"))
+
+    updates = sum(stat["updates"] for stat in stats)
+    elapsed = max(stat["elapsed"] for stat in stats)
+    booked = sum(stat["booked"] for stat in stats)
+    print(
+        f"{count:>7}{updates:>9}{elapsed:>9.2f}{updates / elapsed:>10.1f}"
+        f"{booked:>9}{len(broken):>9}"
+    )
+    return not broken
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=20, help="per worker")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--gifts", type=int, default=10)
+    parser.add_argument("--sheets-latency", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(
+        f"{'workers':>7}{'updates':>9}{'seconds':>9}{'per sec':>10}{'booked':>9}{'doubled':>9}"
+    )
+    ok = all([run(count, args) for count in args.workers])
+    raise SystemExit(0 if ok else 1)
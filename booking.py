@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import weakref
+
+from gspread.utils import rowcol_to_a1
+
+
+def row_cell(row, col):
+    # row_values() is 0-based and drops trailing empty cells
+    return row[col - 1] if len(row) >= col else ""
+
+
+class StaleRow(Exception):
+    """The row no longer holds the gift the caller expected there."""
+
+
+class BookingEngine:
+    """Serialises booking writes so every gift has exactly one winner.
+
+    Each row has its own ``asyncio.Lock``; the status is checked and written
+    while holding it, then read back to make sure nobody outside this process
+    (e.g. a hand edit in the spreadsheet) overwrote it in the meantime.
+
+    The status column shows the booker's name, the booker column holds their
+    Telegram user id; both are written with a single request. The log column
+    is left as it is, the history goes to the booking journal instead. Rows
+    can move when someone sorts the sheet, so every write first checks the
+    row's gift id and raises ``StaleRow`` if it is a different gift now.
+
+    When several bot processes share the sheet, ``lease(gift_id)`` must
+    return an async context manager that excludes the other processes too.
+    It may yield an async ``renew()``, which is awaited right before the
+    write to extend the lease and to fail if another process has taken it.
+    The async ``on_success(row)`` runs after a verified write, still under
+    both locks.
+    """
+
+    def __init__(
+        self,
+        sheet_api,
+        status_col,
+        booker_col,
+        id_col,
+        on_write=None,
+        lease=None,
+    ):
+        self.sheet_api = sheet_api
+        self.status_col = status_col
+        self.booker_col = booker_col
+        self.id_col = id_col
+        self.on_write = on_write  # called after every successful write
+        self.lease = lease
+        # Locks disappear on their own once no handler is waiting on the row
+        self._locks = weakref.WeakValueDictionary()
+
+    def _lock(self, row_num):
+        lock = self._locks.get(row_num)
+        if lock is None:
+            lock = self._locks[row_num] = asyncio.Lock()
+        return lock
+
+    def _lease(self, gift_id):
+        if self.lease is None:
+            return contextlib.nullcontext()
+        return self.lease(gift_id)
+
+    async def _renew(self, renew):
+        if renew is not None:
+            await renew()
+
+    def owns(self, row, user_id, user_name):
+        booker = row_cell(row, self.booker_col)
+        if booker:
+            return booker == str(user_id)
+        # Booked before user ids were recorded: fall back to the name
+        return row_cell(row, self.status_col) == user_name
+
+    async def _read(self, row_num, gift_id):
+        row = await self.sheet_api.row_values(row_num)
+        if row_cell(row, self.id_col) != gift_id:
+            raise StaleRow(row_num)
+        return row
+
+    async def book(self, row_num, gift_id, user_id, user_name, on_success=None):
+        """Book ``row_num`` for the user; returns ``(booked, row)``."""
+        async with self._lock(row_num), self._lease(gift_id) as renew:
+            row = await self._read(row_num, gift_id)
+            if row_cell(row, self.status_col) and not self.owns(
+                row, user_id, user_name
+            ):
+                return False, row
+            await self._renew(renew)
+            row = await self._write(row_num, row, user_name, str(user_id))
+            return await self._verified(row_num, row, on_success), row
+
+    async def unbook(self, row_num, gift_id, user_id, user_name, on_success=None):
+        """Release ``row_num`` if the user holds it; returns ``(unbooked, row)``."""
+        async with self._lock(row_num), self._lease(gift_id) as renew:
+            row = await self._read(row_num, gift_id)
+            if not row_cell(row, self.status_col) or not self.owns(
+                row, user_id, user_name
+            ):
+                return False, row
+            await self._renew(renew)
+            row = await self._write(row_num, row, "", "")
+            return await self._verified(row_num, row, on_success), row
+
+    async def _write(self, row_num, row, status, booker):
+        await self.sheet_api.batch_update(
+            [
+                {"range": rowcol_to_a1(row_num, col), "values": [[value]]}
+                for col, value in ((self.status_col, status), (self.booker_col, booker))
+            ]
+        )
+        if self.on_write:
+            self.on_write(row_num)
+        # Hand back the row as it now looks in the sheet
+        row = list(row) + [""] * (self.booker_col - len(row))
+        row[self.status_col - 1] = status
+        row[self.booker_col - 1] = booker
+        return row
+
+    async def _verified(self, row_num, row, on_success):
+        verified = await self._verify(row_num, row)
+        if verified and on_success:
+            await on_success(row)
+        return verified
+
+    async def _verify(self, row_num, expected):
+        row = await self.sheet_api.row_values(row_num)
+        return all(
+            row_cell(row, col) == row_cell(expected, col)
+            for col in (self.status_col, self.booker_col)
+        )
@@ -1,17 +1,44 @@
 import os
+import functools
+import hashlib
 import logging
+import math
 import random
-import json
-import base64
-from datetime import datetime
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from telegram import (BotCommand, InlineKeyboardButton, InlineKeyboardMarkup,
-                      Update)
-from telegram.ext import (ApplicationBuilder, CallbackQueryHandler,
-                          CommandHandler, ContextTypes)
+from telegram import (
+    BotCommand,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Update,
+)
+from telegram.ext import (
+    ApplicationBuilder,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    InlineQueryHandler,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
+
+from client import SheetsClient
+from indexes import join_thousands, parse_price
+from journal import LOG_SHEET_HEADER, BookingJournal
+from metrics import REGISTRY, serve_metrics, timed_handler
+from persistence import SQLitePersistence
+from ratelimit import FloodControlLimiter, TokenBucket
+from shared import SharedState, retry_busy
+from sheets import AsyncSheet
+from storage import SQLiteStore
+from subscriptions import Broadcaster, Subscriptions
+from tenants import Wishlist, WishlistPool, WishlistRegistry
+from transfer import BadImport, export_gifts, plan_import, read_entries
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -20,36 +47,172 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("BOT_TOKEN")
 SPREADSHEET_NAME = "WishListBot"
-creds_b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
-creds_json = base64.b64decode(creds_b64).decode('utf-8')
-credentials_dict = json.loads(creds_json)
-
-# Setup Google Sheets client
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-]
-credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-    credentials_dict, scope
+
+# Setup Google Sheets client. Nothing is authorised until the first call,
+# which post_init triggers in the background once the bot is up.
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "4"))
+sheets_client = SheetsClient(
+    os.getenv("GOOGLE_CREDENTIALS_B64"), pool_size=SHEETS_MAX_WORKERS
+)
+
+# gspread is blocking; every wishlist's calls share this thread pool
+sheets_executor = ThreadPoolExecutor(
+    max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets"
 )
+SHEETS_MAX_IN_FLIGHT = int(os.getenv("SHEETS_MAX_IN_FLIGHT", "8"))
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "15"))
+# Google calls per minute one wishlist may make, the project gets 300 (0 = off)
+SHEETS_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60"))
+
+
+async def open_sheet(name):
+    return await sheets_client.worksheet(name)
+
+
+# "sheets" keeps all state in the spreadsheet, "sqlite" in a local database
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "wishlist.db")
+
+# With the local store, bookings reach the sheet in the background
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "30"))
 
-gc = gspread.authorize(credentials)
-sheet = gc.open(SPREADSHEET_NAME).sheet1  # First sheet
+# Every booking and release is appended to a journal ("" = off): inside the
+# local database with the sqlite backend, otherwise in JOURNAL_PATH. It is
+# copied to the JOURNAL_SHEET sheet of its spreadsheet ("" = don't copy).
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", SQLITE_PATH)
+JOURNAL_SHEET = os.getenv("JOURNAL_SHEET", "log")
+JOURNAL_SYNC_INTERVAL = float(os.getenv("JOURNAL_SYNC_INTERVAL", "60"))
+
+
+async def open_log_sheet(name):
+    return await sheets_client.worksheet(
+        name, title=JOURNAL_SHEET, header=LOG_SHEET_HEADER
+    )
+
+
+# Seconds between checks whether the spreadsheet was edited by hand (0 = off)
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "5"))
+CHANGE_POLL_MAX_INTERVAL = float(os.getenv("CHANGE_POLL_MAX_INTERVAL", "120"))
+
+# Seconds a downloaded copy of the wishlist is served before re-fetching.
+# With the change feed on, hand edits are picked up without waiting for it.
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL", "300" if CHANGE_POLL_INTERVAL else "30"))
+
+# Number of gifts shown per page of /free and /my_booked
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "8"))
+
+# Seconds Telegram may reuse our answer to the same inline query
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+# Results per inline answer (Telegram allows 50); scrolling loads the next.
+# Every result is serialised on each keystroke, so fewer answer faster.
+INLINE_PAGE_SIZE = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+
+# Subscribers get one digest of freed and new gifts per DIGEST_DELAY seconds;
+# digests go out at DIGEST_RATE a second, below Telegram's 30 for the bot
+DIGEST_DELAY = float(os.getenv("DIGEST_DELAY", "60"))
+DIGEST_RATE = float(os.getenv("DIGEST_RATE", "10"))
+# How long shutdown waits for the digests still queued
+DIGEST_DRAIN_TIMEOUT = float(os.getenv("DIGEST_DRAIN_TIMEOUT", "10"))
+
+# Wishlists kept open at once; the least recently used ones are closed
+MAX_OPEN_WISHLISTS = int(os.getenv("MAX_OPEN_WISHLISTS", "16"))
+# Telegram user ids allowed to switch a chat to another wishlist and to
+# import or export gifts
+ADMIN_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()
+}
+
+# Imported gifts are appended to the sheet this many rows per request
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+
+
+# Several bot processes can serve the same chats when they share this SQLite
+# file: booking leases, cache versions, chat settings and user_data live
+# there. Use it with STORAGE_BACKEND=sqlite and SQLITE_PATH on the same local
+# disk; each worker then needs its own WEBHOOK_PORT behind a load balancer.
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")
+shared_state = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+
+def sqlite_path(name):
+    if name == SPREADSHEET_NAME:
+        return SQLITE_PATH
+    # One database per spreadsheet, next to the default one
+    digest = hashlib.sha1(name.encode()).hexdigest()[:12]
+    return os.path.join(os.path.dirname(SQLITE_PATH), f"wishlist-{digest}.db")
+
+
+def make_wishlist(name):
+    quota = None
+    if SHEETS_QUOTA_PER_MINUTE:
+        quota = TokenBucket(SHEETS_QUOTA_PER_MINUTE, period=60)
+    sheet_api = AsyncSheet(
+        opener=lambda: open_sheet(name),
+        executor=sheets_executor,
+        max_in_flight=SHEETS_MAX_IN_FLIGHT,
+        timeout=SHEETS_TIMEOUT,
+        quota=quota,
+    )
+    local_store = None
+    if STORAGE_BACKEND == "sqlite":
+        local_store = SQLiteStore(sqlite_path(name))
+    journal = log_sheet = None
+    if JOURNAL_PATH and local_store:
+        journal = BookingJournal(conn=local_store.conn)
+    elif JOURNAL_PATH:
+        journal = BookingJournal(JOURNAL_PATH)
+    if journal and JOURNAL_SHEET:
+        log_sheet = AsyncSheet(
+            opener=lambda: open_log_sheet(name),
+            executor=sheets_executor,
+            max_in_flight=SHEETS_MAX_IN_FLIGHT,
+            timeout=SHEETS_TIMEOUT,
+            quota=quota,
+        )
+    return Wishlist(
+        name,
+        sheet_api,
+        local_store=local_store,
+        snapshot_ttl=SNAPSHOT_TTL,
+        sync_interval=SYNC_INTERVAL,
+        poll_interval=CHANGE_POLL_INTERVAL,
+        poll_max_interval=CHANGE_POLL_MAX_INTERVAL,
+        shared=shared_state,
+        journal=journal,
+        log_sheet=log_sheet,
+        journal_interval=JOURNAL_SYNC_INTERVAL,
+        on_available=announce,
+        available_delay=DIGEST_DELAY,
+    )
+
+
+wishlists = WishlistPool(
+    make_wishlist, max_size=MAX_OPEN_WISHLISTS, pinned=[SPREADSHEET_NAME]
+)
+registry = WishlistRegistry(
+    os.getenv("WISHLIST_REGISTRY_PATH", SQLITE_PATH),
+    default=SPREADSHEET_NAME,
+    cache=not shared_state,
+)
 
 
-class TableHeaders:
-    gift_name = 1
-    price = 2
-    link = 3
-    status = 4
+subscriptions = Subscriptions(os.getenv("SUBSCRIPTIONS_PATH", SQLITE_PATH))
+# Sends the digests in the background, started by post_init
+broadcaster = None
 
 
-class CellHeaders:
-    gift_name = 2
-    price = 3
-    link = 4
-    status = 5
-    log = 6
+def announce(name, items):
+    """Queue a digest of ``items`` for everyone subscribed to wishlist ``name``."""
+    if broadcaster is not None:
+        broadcaster.publish(subscriptions.chats(name), items)
+
+
+def wishlist_for(update):
+    """The wishlist of the chat ``update`` came from."""
+    chat = update.effective_chat
+    chat_id = chat.id if chat else update.effective_user.id
+    return wishlists.get(registry.name_for(chat_id))
 
 
 HELLO_MESSAGES = [
@@ -115,6 +278,9 @@ CANCEL_BUTTON_LONG_VARIANTS = [
     "❌ Обійдусь якось без цього дива",
 ]
 
+# Old buttons can point at a gift that has since been removed from the sheet
+MISSING_GIFT_MESSAGE = "🤷 Цього подарунка вже немає у списку. Глянь свіжий: /free"
+
 VIEW_BUTTON_VARIANTS = [
     "👀 Погляну",
     "👀 Що це?",
@@ -129,6 +295,15 @@ VIEW_BUTTON_VARIANTS = [
 ]
 
 
+def view_button(text, link):
+    """The button opening the gift's link, as a list; none if it has no link.
+
+    Telegram rejects a button with an empty url, which would take the whole
+    message down with it.
+    """
+    return [InlineKeyboardButton(text, url=link)] if link else []
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user  # Get user info
     user_name = user.full_name if user else "всім"
@@ -148,56 +323,251 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+BUDGET_LOW_WORDS = {"від", "over", "above", "from", ">", "min", "мін"}
+BUDGET_HINT = (
+    "🤔 Не зрозумів бюджет. Спробуй так: /free до 500, /free 300-800, "
+    "/free дешевші або /free дорожчі"
+)
+
+
+def parse_budget(args):
+    """``/free`` arguments as ``(low, high, descending)``.
+
+    Understands "до 500", "від 300", "300-800" and a bare "500" (an upper
+    limit), plus "дешевші"/"дорожчі" (or "cheap"/"expensive") for the
+    order. Returns None when no budget or order is given.
+    """
+    text = join_thousands(" ".join(args).casefold())
+    descending = bool(re.search(r"дорож|дорог|expensive", text))
+    ascending = bool(re.search(r"дешев|cheap", text))
+    low = high = None
+    bounds = re.search(r"(\d+(?:[.,]\d+)?)\s*[-–]\s*(\d+(?:[.,]\d+)?)", text)
+    if bounds:
+        low, high = sorted(parse_price(number) for number in bounds.groups())
+    else:
+        for word, number in re.findall(r"([^\W\d]+|[<>])?\s*(\d+(?:[.,]\d+)?)", text):
+            if word in BUDGET_LOW_WORDS:
+                low = parse_price(number)
+            else:
+                high = parse_price(number)
+    if low is None and high is None and not descending and not ascending:
+        return None
+    return low, high, descending
+
+
+def budget_data(budget):
+    """``budget`` as the tail of a callback data string."""
+    low, high, descending = budget
+    return "|".join(
+        [
+            "" if low is None else f"{low:g}",
+            "" if high is None else f"{high:g}",
+            "d" if descending else "a",
+        ]
+    )
+
+
+def budget_from_data(fields):
+    low, high, order = fields
+    return (float(low) if low else None, float(high) if high else None, order == "d")
+
+
+async def list_gifts(wishlist, kind, user, budget=None):
+    if kind == "free":
+        gifts = await wishlist.snapshot.get()
+        if budget:
+            # The snapshot refresh above has brought the index up to date
+            return wishlist.price_index.select(*budget)
+        return [gift for gift in gifts if not gift["status"]]
+    # The index follows this process's writes; reload only to build it or to
+    # pick up another worker's, not after every booking invalidated the rows
+    if not wishlist.booked_index.ready or wishlist.snapshot.shared_changed():
+        await wishlist.snapshot.get()
+    return wishlist.booked_index.gifts_for(user.id, user.full_name)
+
+
+def render_page(kind, gifts, page, budget=None, owner=None):
+    """One message with ``PAGE_SIZE`` gifts of the list and prev/next buttons.
+
+    A booked list belongs to the user id ``owner``; its page buttons carry
+    it, so nobody else can page through it.
+    """
+    pages = max(1, math.ceil(len(gifts) / PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    first, last = page * PAGE_SIZE, (page + 1) * PAGE_SIZE
+    page_gifts = gifts[first:last]
+
+    if kind == "free" and budget and not gifts:
+        title = "🙅‍ У цьому бюджеті вільних подарунків немає. Глянь усі: /free"
+    elif kind == "free":
+        title = (
+            "🎉 Тут лежать подарунки, які ще не встигли втекти!"
+            if gifts
+            else "🙅‍ Немає вільних подарунків, тримай кулачки!."
+        )
+    else:
+        title = (
+            "Ти справді щось взяв? Вітаю з дивом!"
+            if gifts
+            else "🕵️‍♂️ Твій список подарунків пустий, як твої оправдання."
+        )
+
+    lines = [title, ""] if gifts else [title]
+    keyboard = []
+    for number, gift in enumerate(page_gifts, start=first + 1):
+        if budget and gift["price"]:
+            lines.append(f"{number}. 🎁 {gift['gift_name']} — {gift['price']}")
+        else:
+            lines.append(f"{number}. 🎁 {gift['gift_name']}")
+        view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
+        if kind == "free":
+            action_button = InlineKeyboardButton(
+                f"{number}. {random.choice(BOOK_BUTTON_VARIANTS)}",
+                callback_data=f"book|{gift['gift_id']}",
+            )
+        else:
+            action_button = InlineKeyboardButton(
+                f"{number}. {random.choice(CANCEL_BUTTON_VARIANTS)}",
+                callback_data=f"remove|{gift['gift_id']}",
+            )
+        keyboard.append(
+            [
+                *view_button(f"{number}. {view_button_text}", gift["link"]),
+                action_button,
+            ]
+        )
+
+    if pages > 1:
+        # Paging keeps the budget, or whose booked list it is
+        if kind == "booked":
+            tail = f"|{owner}"
+        else:
+            tail = f"|{budget_data(budget)}" if budget else ""
+        navigation = []
+        if page > 0:
+            navigation.append(
+                InlineKeyboardButton("⬅️", callback_data=f"page|{kind}|{page - 1}{tail}")
+            )
+        navigation.append(
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop")
+        )
+        if page < pages - 1:
+            navigation.append(
+                InlineKeyboardButton("➡️", callback_data=f"page|{kind}|{page + 1}{tail}")
+            )
+        keyboard.append(navigation)
+
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    return "\n".join(lines), reply_markup
+
+
 async def show_free_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = sheet.get_all_records()
-    keyboards = []
-    names = []
-    # Start at 2 to account for header row
-    for idx, row in enumerate(data, start=2):
-        if not row["status"]:
-            names.append(row["gift_name"])
-            confirm_button_text = random.choice(BOOK_BUTTON_VARIANTS)
-            view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
-            keyboards.append(
+    # Also opened from the /start button, which has no arguments
+    args = context.args or []
+    budget = parse_budget(args)
+    if args and budget is None:
+        await update.message.reply_text(BUDGET_HINT)
+        return
+    gifts = await list_gifts(
+        wishlist_for(update), "free", update.effective_user, budget
+    )
+    text, reply_markup = render_page("free", gifts, 0, budget)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup
+    )
+
+
+async def change_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, kind, page, *rest = query.data.split("|")
+    budget = None
+    if kind == "booked":
+        # In a group, someone else's list would turn into the presser's own
+        if rest != [str(query.from_user.id)]:
+            await query.answer(
+                "🙈 Це чужий список. Свій дивись тут: /my_booked", show_alert=True
+            )
+            return
+    elif rest:
+        budget = budget_from_data(rest)
+    await query.answer()
+
+    gifts = await list_gifts(wishlist_for(update), kind, query.from_user, budget)
+    text, reply_markup = render_page(
+        kind, gifts, int(page), budget, owner=query.from_user.id
+    )
+
+    # Edit the list in place instead of sending a new message
+    await query.edit_message_text(text=text, reply_markup=reply_markup)
+
+
+# Gift id -> (gift, its inline result), reused until the gift changes
+inline_results = {}
+
+
+def inline_result(gift):
+    cached = inline_results.get(gift["gift_id"])
+    if cached and cached[0] is gift:
+        return cached[1]
+    result = InlineQueryResultArticle(
+        id=gift["gift_id"],
+        title=gift["gift_name"],
+        description=gift["price"] or None,
+        input_message_content=InputTextMessageContent(f"🎁 {gift['gift_name']}"),
+        reply_markup=InlineKeyboardMarkup(
+            [
                 [
-                    InlineKeyboardButton(view_button_text, url=row["link"]),
+                    *view_button(random.choice(VIEW_BUTTON_VARIANTS), gift["link"]),
                     InlineKeyboardButton(
-                        confirm_button_text, callback_data=f"book|{idx}"
+                        random.choice(BOOK_BUTTON_VARIANTS),
+                        callback_data=f"book|{gift['gift_id']}",
                     ),
                 ]
-            )
-    text = (
-        "🎉 Тут лежать подарунки, які ще не встигли втекти!"
-        if keyboards
-        else "🙅‍ Немає вільних подарунків, тримай кулачки!."
-    )
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
-
-    for name, keyboard in zip(names, keyboards):
-        reply_markup = InlineKeyboardMarkup([keyboard])
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"🎁 {name}",
-            reply_markup=reply_markup,
-        )
+            ]
+        ),
+    )
+    inline_results[gift["gift_id"]] = gift, result
+    return result
+
+
+async def search_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    index = wishlist_for(update).search_index
+    if not index.ready:
+        # Still warming up; answer right away instead of waiting for the sheet
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+
+    offset = int(query.offset or 0)
+    next_offset = offset + INLINE_PAGE_SIZE
+    gifts = index.search(query.query)
+    await query.answer(
+        [inline_result(gift) for gift in gifts[offset:next_offset]],
+        cache_time=INLINE_CACHE_TIME,
+        # Chats can use different wishlists
+        is_personal=True,
+        next_offset=str(next_offset) if next_offset < len(gifts) else "",
+    )
 
 
 async def confirm_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    action, row_num = query.data.split("|")
-    row_num = int(row_num)
+    action, gift_id = query.data.split("|")
 
-    row = sheet.row_values(row_num)
-    gift_name = row[TableHeaders.gift_name]
+    gift = await wishlist_for(update).store.get_gift(gift_id)
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+        return
+    gift_name = gift["gift_name"]
 
     # Store details in user_data so we can restore later if canceled
     context.user_data["last_gift"] = {
-        "row_num": row_num,
+        "gift_id": gift_id,
         "gift_name": f"🎁 {gift_name}",
-        "price": row[TableHeaders.price],
-        "link": row[TableHeaders.link],
+        "price": gift["price"],
+        "link": gift["link"],
     }
     confirm_button_text = random.choice(BOOK_BUTTON_LONG_VARIANTS)
     cancel_button_text = random.choice(CANCEL_BUTTON_LONG_VARIANTS)
@@ -206,7 +576,7 @@ async def confirm_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [
             [
                 InlineKeyboardButton(
-                    confirm_button_text, callback_data=f"confirm|{row_num}"
+                    confirm_button_text, callback_data=f"confirm|{gift_id}"
                 )
             ],
             [InlineKeyboardButton(cancel_button_text, callback_data="cancel")],
@@ -224,46 +594,33 @@ async def finalize_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    action, row_num = query.data.split("|")
-    row_num = int(row_num)
+    action, gift_id = query.data.split("|")
     user_name = query.from_user.full_name
 
-    current_status = sheet.cell(row_num, CellHeaders.status).value
-    if current_status and current_status != user_name:
+    booked, gift = await wishlist_for(update).store.book(
+        gift_id, query.from_user.id, user_name
+    )
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+
+    elif not booked:
         await query.edit_message_text(
             "❌ Ой, вибач, цей подарунок уже хтось спритний собі приприватив. Швидше наступного шукай!"
         )
 
     else:
-        sheet.update_cell(
-            row_num, CellHeaders.status, user_name
-        )  # Column 5: status (booked by)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        user_name = query.from_user.full_name
-        log_entry = f"📌 Booked by {user_name} at {timestamp}"
-
-        # Update status
-        sheet.update_cell(row_num, CellHeaders.status, user_name)
-
-        # Append to log
-        existing_log = sheet.cell(row_num, CellHeaders.log).value or ""
-        updated_log = f"{existing_log}\n{log_entry}".strip()
-
-        sheet.update_cell(row_num, CellHeaders.log, updated_log)
         cancel_button_text = random.choice(CANCEL_BUTTON_VARIANTS)
 
-        gift_name = sheet.cell(row_num, CellHeaders.gift_name).value
+        gift_name = gift["gift_name"]
+        link = gift["link"]
         view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
 
         keyboard = InlineKeyboardMarkup(
             [
                 [
+                    *view_button(view_button_text, link),
                     InlineKeyboardButton(
-                        view_button_text,
-                        url=sheet.cell(row_num, CellHeaders.link).value,
-                    ),
-                    InlineKeyboardButton(
-                        cancel_button_text, callback_data=f"unbook|{row_num}"
+                        cancel_button_text, callback_data=f"unbook|{gift_id}"
                     ),
                 ]
             ]
@@ -288,7 +645,7 @@ async def cancel_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
     gift_name = last["gift_name"]
     # price = last["price"]
     link = last["link"]
-    row_num = last["row_num"]
+    gift_id = last["gift_id"]
 
     confirm_button_text = random.choice(BOOK_BUTTON_VARIANTS)
     view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
@@ -296,9 +653,9 @@ async def cancel_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
     reply_markup = InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton(view_button_text, url=link),
+                *view_button(view_button_text, link),
                 InlineKeyboardButton(
-                    confirm_button_text, callback_data=f"book|{row_num}"
+                    confirm_button_text, callback_data=f"book|{gift_id}"
                 ),
             ]
         ]
@@ -312,38 +669,28 @@ async def cancel_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     try:
-        _, row_num = query.data.split("|")
-        row_num = int(row_num)
+        _, gift_id = query.data.split("|")
     except ValueError:
         await query.edit_message_text("⚠️ Некоректна дія.")
         return
 
     user_name = query.from_user.full_name
-    current_status = sheet.cell(row_num, CellHeaders.status).value
-    gift_name = sheet.cell(row_num, CellHeaders.gift_name).value
+    unbooked, gift = await wishlist_for(update).store.unbook(
+        gift_id, query.from_user.id, user_name
+    )
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+        return
+    gift_name = gift["gift_name"]
 
-    if current_status != user_name:
+    if not unbooked:
         await query.edit_message_text(
             "❌ Ой-ой, цей подарунок ти не забронював. Мабуть, плутаєшся у подарунках?"
         )
         return
 
-    # Remove booking
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user_name = query.from_user.full_name
-    log_entry = f"❌ Unbooked by {user_name} at {timestamp}"
-
-    # Unset booking
-    sheet.update_cell(row_num, CellHeaders.status, "")
-
-    # Append to log
-    existing_log = sheet.cell(row_num, CellHeaders.log).value or ""
-    updated_log = f"{existing_log}\n{log_entry}".strip()
-
-    sheet.update_cell(row_num, CellHeaders.log, updated_log)
-
     # Restore original "Хочу" button
-    link = sheet.cell(row_num, CellHeaders.link).value
+    link = gift["link"]
 
     button_text = random.choice(BOOK_BUTTON_VARIANTS)
     view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
@@ -351,8 +698,8 @@ async def cancel_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton(view_button_text, url=link),
-                InlineKeyboardButton(button_text, callback_data=f"book|{row_num}"),
+                *view_button(view_button_text, link),
+                InlineKeyboardButton(button_text, callback_data=f"book|{gift_id}"),
             ]
         ]
     )
@@ -362,67 +709,45 @@ async def cancel_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_booked_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
-        user_name = update.message.from_user.full_name
+        user = update.message.from_user
     else:
         query = update.callback_query
         await query.answer()
 
-        user_name = query.from_user.full_name
-
-    data = sheet.get_all_records()
-    booked = []
-    names = []
-
-    for idx, row in enumerate(data, start=2):
-        if row["status"] == user_name:
-            names.append(
-                row["gift_name"],
-            )
-            cancel_button_text = random.choice(CANCEL_BUTTON_VARIANTS)
-            view_button_text = random.choice(VIEW_BUTTON_VARIANTS)
-            booked.append(
-                [
-                    InlineKeyboardButton(view_button_text, url=row["link"]),
-                    InlineKeyboardButton(
-                        cancel_button_text, callback_data=f"remove|{idx}"
-                    ),
-                ]
-            )
+        user = query.from_user
 
-    text = (
-        "Ти справді щось взяв? Вітаю з дивом!"
-        if booked
-        else "🕵️‍♂️ Твій список подарунків пустий, як твої оправдання."
+    text, reply_markup = render_page(
+        "booked",
+        await list_gifts(wishlist_for(update), "booked", user),
+        0,
+        owner=user.id,
+    )
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup
     )
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
-
-    for name, book in zip(names, booked):
-        reply_markup = InlineKeyboardMarkup([book])
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"🎁 {name}",
-            reply_markup=reply_markup,
-        )
 
 
 async def remove_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    action, row_num = query.data.split("|")
-    row_num = int(row_num)
+    action, gift_id = query.data.split("|")
 
-    gift_name = sheet.cell(row_num, CellHeaders.gift_name).value
+    gift = await wishlist_for(update).store.get_gift(gift_id)
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+        return
+    gift_name = gift["gift_name"]
 
     keyboard = InlineKeyboardMarkup(
         [
             [
                 InlineKeyboardButton(
                     "Так, скасовую ❌",
-                    callback_data=f"remove_confirm|{row_num}",
+                    callback_data=f"remove_confirm|{gift_id}",
                 ),
                 InlineKeyboardButton(
-                    "Ні, залишаю 👍", callback_data=f"remove_abort|{row_num}"
+                    "Ні, залишаю 👍", callback_data=f"remove_abort|{gift_id}"
                 ),
             ]
         ]
@@ -439,32 +764,24 @@ async def remove_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    _, row_num = query.data.split("|")
-    row_num = int(row_num)
+    _, gift_id = query.data.split("|")
 
     user_name = query.from_user.full_name
-    current_status = sheet.cell(row_num, CellHeaders.status).value
-    gift_name = sheet.cell(row_num, CellHeaders.gift_name).value
+    unbooked, gift = await wishlist_for(update).store.unbook(
+        gift_id, query.from_user.id, user_name
+    )
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+        return
+    gift_name = gift["gift_name"]
 
-    if current_status != user_name:
+    if not unbooked:
         await query.edit_message_text(
             f"❌ Цей подарунок *{gift_name}* не твій. Але приємно, що ти спробував!",
             parse_mode="Markdown",
         )
         return
 
-    # Логування зняття броні
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"❌ Unbooked by {user_name} at {timestamp}"
-
-    # Знімаємо бронь
-    sheet.update_cell(row_num, CellHeaders.status, "")
-
-    # Оновлюємо лог
-    existing_log = sheet.cell(row_num, CellHeaders.log).value or ""
-    updated_log = f"{existing_log}\n{log_entry}".strip()
-    sheet.update_cell(row_num, CellHeaders.log, updated_log)
-
     await query.edit_message_text(
         f"✅ Бронювання знято: *{gift_name}*. Ну що ж, ще передумаєш — не дивуйся, якщо його вже не буде 😉",
         parse_mode="Markdown",
@@ -475,10 +792,13 @@ async def remove_abort(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    _, row_num = query.data.split("|")
-    row_num = int(row_num)
+    _, gift_id = query.data.split("|")
 
-    gift_name = sheet.cell(row_num, CellHeaders.gift_name).value
+    gift = await wishlist_for(update).store.get_gift(gift_id)
+    if gift is None:
+        await query.edit_message_text(MISSING_GIFT_MESSAGE)
+        return
+    gift_name = gift["gift_name"]
 
     await query.edit_message_text(
         f"👌 Бронювання *{gift_name}* залишилось без змін. Добре подумав!",
@@ -486,16 +806,208 @@ async def remove_abort(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def send_digest(bot, chat_id, items):
+    shown = items[:PAGE_SIZE]
+    lines = ["🔔 Новини зі списку подарунків!", ""]
+    keyboard = []
+    for number, (kind, gift) in enumerate(shown, start=1):
+        mark = "🆕" if kind == "added" else "🔓"
+        lines.append(f"{number}. {mark} {gift['gift_name']}")
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"{number}. {random.choice(BOOK_BUTTON_VARIANTS)}",
+                    callback_data=f"book|{gift['gift_id']}",
+                )
+            ]
+        )
+    if len(items) > len(shown):
+        lines.append(f"…і ще {len(items) - len(shown)}. Усі вільні: /free")
+    lines += ["", "🆕 — новий, 🔓 — знову вільний. Відписатись: /unsubscribe"]
+    await bot.send_message(
+        chat_id=chat_id,
+        text="\n".join(lines),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        # A throttled chat's digest is retried by the broadcaster, after the
+        # other chats, rather than by the rate limiter right away
+        rate_limit_args=0,
+    )
+
+
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    await retry_busy(subscriptions.add, chat_id, registry.name_for(chat_id))
+    await update.message.reply_text(
+        "🔔 Домовились! Щойно щось звільниться або з'явиться новий подарунок — "
+        "напишу. Відписатись: /unsubscribe"
+    )
+
+
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await retry_busy(subscriptions.remove, update.effective_chat.id):
+        await update.message.reply_text("🔕 Все, більше не турбую.")
+    else:
+        await update.message.reply_text("🤷 Тут і так ніхто не підписаний.")
+
+
 async def set_menu_commands(app):
     await app.bot.set_my_commands(
         [
             BotCommand("start", "📦 Перезапуск місії 'Подарунок'"),
-            BotCommand("free", "🎁 Подарунки, які ще не вкрали"),
+            BotCommand("free", "🎁 Подарунки, які ще не вкрали (/free до 500)"),
             BotCommand("my_booked", "🔒 Mої трофеї"),
+            BotCommand("subscribe", "🔔 Сповіщати про вільні й нові подарунки"),
         ]
     )
 
 
+async def note_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    wishlist_for(update).touch()
+
+
+async def choose_wishlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    if not context.args:
+        await update.message.reply_text(
+            f"📋 Тут використовується список «{registry.name_for(chat_id)}»."
+        )
+        return
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Змінювати список можуть лише адміни.")
+        return
+
+    name = " ".join(context.args)
+    opened = name in wishlists
+    try:
+        if not opened:
+            # A wrong name must not take a place in the pool (or a local file)
+            await open_sheet(name)
+        await wishlists.get(name).reload_from_sheet()
+    except Exception:
+        logger.exception("Could not open wishlist %r", name)
+        if not opened:
+            await wishlists.discard(name)
+        await update.message.reply_text(
+            f"😕 Не вдалося відкрити таблицю «{name}». Перевір назву і доступ."
+        )
+        return
+    await retry_busy(registry.assign, chat_id, name)
+    await retry_busy(subscriptions.follow, chat_id, name)
+    await update.message.reply_text(f"✅ Тепер тут список «{name}».")
+
+
+IMPORT_HINT = (
+    "📥 Надішли файл .csv або .json з колонками gift_name, price, link "
+    "(або назва, ціна, посилання); посилання обов'язкове. Подарунки, які вже "
+    "є у списку, пропущу. "
+    "Вивантажити список: /export або /export json"
+)
+
+
+def describe_entries(entries, limit=5):
+    shown = ", ".join(f"№{entry['line']}" for entry in entries[:limit])
+    if len(entries) > limit:
+        shown += f" і ще {len(entries) - limit}"
+    return shown
+
+
+async def import_hint(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Імпортувати подарунки можуть лише адміни.")
+        return
+    await update.message.reply_text(IMPORT_HINT)
+
+
+async def import_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    if (document.file_size or 0) > IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"🐘 Файл завеликий, максимум {IMPORT_MAX_BYTES // 1024 // 1024} МБ."
+        )
+        return
+    data = await (await document.get_file()).download_as_bytearray()
+    try:
+        entries = read_entries(data, document.file_name or "")
+    except BadImport as error:
+        await update.message.reply_text(f"😕 Не вдалося прочитати файл: {error}")
+        return
+
+    wishlist = wishlist_for(update)
+    # Checked against the cached rows, not cell by cell in the sheet
+    rows, duplicates, invalid = plan_import(entries, await wishlist.snapshot.get())
+    added = 0
+    try:
+        while added < len(rows):
+            end = added + IMPORT_BATCH_SIZE
+            await wishlist.sheet_api.append_rows(rows[added:end])
+            added = min(end, len(rows))
+    except Exception:
+        logger.exception("Import into %r stopped after %d rows", wishlist.name, added)
+    if added:
+        await wishlist.reload_from_sheet()
+
+    lines = [f"📥 Додано подарунків: {added}."]
+    if added < len(rows):
+        lines.append(
+            f"😕 Ще {len(rows) - added} не вдалося записати в таблицю. Надішли файл "
+            "ще раз, вже додані я пропущу."
+        )
+    if duplicates:
+        lines.append(
+            f"🔁 Вже є у списку ({len(duplicates)}): {describe_entries(duplicates)}"
+        )
+    for entry, reason in invalid[:5]:
+        lines.append(f"⚠️ №{entry['line']}: {reason}")
+    if len(invalid) > 5:
+        lines.append(f"⚠️ …і ще {len(invalid) - 5} з помилками")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def export_wishlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Вивантажувати список можуть лише адміни.")
+        return
+    fmt = "json" if context.args and context.args[0].lower() == "json" else "csv"
+    wishlist = wishlist_for(update)
+    gifts = await wishlist.snapshot.get()
+    history = None
+    if wishlist.journal:
+        # Bookings since the log column was frozen are only in the journal
+        history = functools.partial(wishlist.journal.history, wishlist.name, limit=None)
+    with export_gifts(gifts, fmt, history) as document:
+        await update.message.reply_document(document, filename=f"{wishlist.name}.{fmt}")
+
+
+async def post_init(app):
+    global broadcaster
+    broadcaster = Broadcaster(
+        functools.partial(send_digest, app.bot),
+        rate=DIGEST_RATE,
+        on_blocked=functools.partial(retry_busy, subscriptions.remove),
+        delay=rate_limiter.chat_delay,
+    )
+    broadcaster.start()
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT, METRICS_PATH)
+        logger.info("Serving metrics on :%d%s", METRICS_PORT, METRICS_PATH)
+    # Opening the default wishlist warms it up in the background. Don't hold
+    # the webhook back for Google: handlers that need the sheet simply wait
+    # for the same lazily created client.
+    wishlists.get(SPREADSHEET_NAME)
+    await set_menu_commands(app)
+
+
+async def post_stop(app):
+    # Closing a wishlist reports the gifts still in its digest window, so the
+    # broadcaster stops after that, once the digests are out
+    await wishlists.close()
+    await broadcaster.stop(timeout=DIGEST_DRAIN_TIMEOUT)
+    registry.close()
+    subscriptions.close()
+    if shared_state:
+        shared_state.close()
+
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -507,31 +1019,120 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_booked_gifts(update, context=context)
 
 
-
 ## WEB hook start
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = "https://wishlist-telegram-bot.onrender.com" + WEBHOOK_PATH
 
-app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+# Telegram only delivers to 443, 80, 88 and 8443; a proxy in front may
+# forward to any port
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "443"))
 
-app.post_init = set_menu_commands
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("free", show_free_gifts))
-app.add_handler(CommandHandler("my_booked", show_booked_gifts))
-app.add_handler(CallbackQueryHandler(confirm_booking, pattern="^book\\|"))
-app.add_handler(CallbackQueryHandler(finalize_booking, pattern="^confirm\\|"))
-app.add_handler(CallbackQueryHandler(remove_booking, pattern="^remove\\|"))
-app.add_handler(CallbackQueryHandler(cancel_confirmation, pattern="^cancel$"))
-app.add_handler(CallbackQueryHandler(cancel_booking, pattern="^unbook\\|"))
-app.add_handler(CallbackQueryHandler(remove_confirm, pattern=r"^remove_confirm\|"))
-app.add_handler(CallbackQueryHandler(remove_abort, pattern=r"^remove_abort\|"))
-app.add_handler(CallbackQueryHandler(button_handler))
+# Prometheus scrape endpoint next to the webhook listener (0 turns it off).
+# Workers on shared state would all bind the same port, so there it is off
+# unless each worker is given its own.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0" if shared_state else "9090"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# Queues outgoing Bot API calls so bursts stay within Telegram's flood limits
+rate_limiter = FloodControlLimiter()
+
+# user_data (pending confirmations) survives restarts; empty path turns it off
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", SQLITE_PATH)
+PERSISTENCE_INTERVAL = float(
+    os.getenv("PERSISTENCE_INTERVAL", "1" if shared_state else "10")
+)
+
+telegram_queue = REGISTRY.gauge(
+    "telegram_queue_depth", "Bot API calls waiting in the rate limiter"
+)
+telegram_wait_max = REGISTRY.gauge(
+    "telegram_queue_wait_max_seconds", "Longest wait in the rate limiter so far"
+)
+
+
+digest_queue = REGISTRY.gauge(
+    "digest_queue_depth", "Subscriber digests waiting to be sent"
+)
+
+
+@REGISTRY.add_collector
+def collect_rate_limiter():
+    stats = rate_limiter.stats()
+    telegram_queue.set(stats["depth"])
+    telegram_wait_max.set(stats["wait_seconds_max"])
+    if broadcaster is not None:
+        digest_queue.set(len(broadcaster))
+
+
+def build_application(builder):
+    """Finish ``builder`` (token, request objects, ...) into the bot's app."""
+    builder = builder.rate_limiter(rate_limiter)
+    if PERSISTENCE_PATH:
+        builder = builder.persistence(
+            SQLitePersistence(
+                PERSISTENCE_PATH,
+                update_interval=PERSISTENCE_INTERVAL,
+                shared=bool(shared_state),
+            )
+        )
+    app = builder.build()
+
+    app.post_init = post_init
+    app.post_stop = post_stop
+    # Runs before the real handlers for every update
+    app.add_handler(TypeHandler(Update, note_activity), group=-1)
+    app.add_handler(CommandHandler("start", timed_handler(start)))
+    app.add_handler(CommandHandler("wishlist", timed_handler(choose_wishlist)))
+    app.add_handler(CommandHandler("free", timed_handler(show_free_gifts)))
+    app.add_handler(CommandHandler("my_booked", timed_handler(show_booked_gifts)))
+    app.add_handler(CommandHandler("subscribe", timed_handler(subscribe)))
+    app.add_handler(CommandHandler("unsubscribe", timed_handler(unsubscribe)))
+    app.add_handler(CommandHandler("import", timed_handler(import_hint)))
+    app.add_handler(CommandHandler("export", timed_handler(export_wishlist)))
+    # Only admins' files are imports; anyone else's are left alone, without
+    # a reply, in whatever chat they were shared
+    csv_files = filters.Document.FileExtension("csv")
+    json_files = filters.Document.FileExtension("json")
+    admins = filters.User(user_id=ADMIN_IDS)
+    app.add_handler(
+        MessageHandler((csv_files | json_files) & admins, timed_handler(import_gifts))
+    )
+    app.add_handler(InlineQueryHandler(timed_handler(search_gifts)))
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(confirm_booking), pattern="^book\\|")
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(finalize_booking), pattern="^confirm\\|")
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(remove_booking), pattern="^remove\\|")
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(cancel_confirmation), pattern="^cancel$")
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(cancel_booking), pattern="^unbook\\|")
+    )
+    app.add_handler(
+        CallbackQueryHandler(
+            timed_handler(remove_confirm), pattern=r"^remove_confirm\|"
+        )
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(remove_abort), pattern=r"^remove_abort\|")
+    )
+    app.add_handler(
+        CallbackQueryHandler(timed_handler(change_page), pattern=r"^page\|")
+    )
+    app.add_handler(CallbackQueryHandler(timed_handler(button_handler)))
+    return app
 
 
 if __name__ == "__main__":
+    app = build_application(ApplicationBuilder().token(TELEGRAM_BOT_TOKEN))
     app.run_webhook(
-        listen="0.0.0.0",          # listen on all IPs
-        port=443,                 # port to listen on
+        listen="0.0.0.0",  # listen on all IPs
+        port=WEBHOOK_PORT,  # port to listen on
         webhook_url=WEBHOOK_URL,
         url_path=WEBHOOK_PATH,
         # secret_token="your_secret_token"  # optional, but recommended
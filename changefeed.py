@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+from sync import is_retryable
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """Notices edits made directly in the spreadsheet.
+
+    Instead of downloading the whole sheet on a timer, this task asks Drive
+    for the spreadsheet's ``modifiedTime``, a tiny metadata request, and only
+    calls ``on_change`` (which reloads the rows) when that has moved. While
+    the bot is in use (``touch``) it checks every ``min_interval`` seconds;
+    once nothing has happened for ``idle_after`` seconds the interval doubles
+    up to ``max_interval``.
+    """
+
+    def __init__(
+        self,
+        sheet_api,
+        on_change,
+        min_interval=5.0,
+        max_interval=120.0,
+        idle_after=300.0,
+    ):
+        self.sheet_api = sheet_api
+        self.on_change = on_change  # async callable
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_after = idle_after
+        self.interval = min_interval
+        self.modified = None
+        self._active_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def touch(self):
+        """Record activity: poll quickly again from now on."""
+        self._active_at = time.monotonic()
+        if self.interval > self.min_interval:
+            self.interval = self.min_interval
+            self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.poll()
+            except Exception as error:
+                if is_retryable(error):
+                    logger.warning("Change check failed (%r)", error)
+                else:
+                    logger.exception("Change check failed")
+                self.interval = min(self.max_interval, self.interval * 2)
+                continue
+
+            if time.monotonic() - self._active_at > self.idle_after:
+                self.interval = min(self.max_interval, self.interval * 2)
+            else:
+                self.interval = self.min_interval
+
+    async def poll(self):
+        """Reload if the spreadsheet changed; returns whether it did."""
+        modified = await self.sheet_api.last_update_time()
+        if modified == self.modified:
+            return False
+        if self.modified is None:
+            # Whatever the sheet holds now is what the warm-up loads
+            self.modified = modified
+            return False
+        logger.info("Spreadsheet modified at %s, reloading", modified)
+        self._active_at = time.monotonic()
+        await self.on_change()
+        self.modified = modified
+        return True
@@ -0,0 +1,79 @@
+import asyncio
+import base64
+import json
+import logging
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+class SheetsClient:
+    """Authorised gspread client, created on first use instead of at import.
+
+    Authorisation and opening spreadsheets are blocking network calls, so
+    they run in a worker thread; concurrent callers share the same attempt.
+    Every worksheet, whichever spreadsheet it belongs to, goes through one
+    ``requests`` session, which keeps its HTTPS connections to Google alive
+    between calls.
+    """
+
+    def __init__(self, credentials_b64, pool_size=10):
+        self.credentials_b64 = credentials_b64
+        self.pool_size = pool_size
+        self._client = None
+        self._lock = asyncio.Lock()
+
+    def _authorize(self):
+        if not self.credentials_b64:
+            raise RuntimeError("GOOGLE_CREDENTIALS_B64 is not set")
+        credentials_dict = json.loads(base64.b64decode(self.credentials_b64))
+        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
+            credentials_dict, SCOPE
+        )
+        client = gspread.authorize(credentials)
+        # Enough pooled keep-alive connections for every worker thread
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        client.http_client.session.mount("https://", adapter)
+        return client
+
+    async def client(self):
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    self._client = await asyncio.to_thread(self._authorize)
+                    logger.info("Authorised Google Sheets client")
+        return self._client
+
+    async def worksheet(self, spreadsheet_name, title=None, header=None):
+        """A sheet of ``spreadsheet_name``; callers keep the handle.
+
+        Without ``title`` it is the first sheet. A titled sheet that doesn't
+        exist yet is added, with ``header`` as its first row.
+        """
+        client = await self.client()
+        spreadsheet = await asyncio.to_thread(client.open, spreadsheet_name)
+        if title is None:
+            return spreadsheet.sheet1
+        return await asyncio.to_thread(self._titled, spreadsheet, title, header)
+
+    @staticmethod
+    def _titled(spreadsheet, title, header):
+        try:
+            return spreadsheet.worksheet(title)
+        except gspread.WorksheetNotFound:
+            pass
+        worksheet = spreadsheet.add_worksheet(
+            title, rows=1, cols=len(header) if header else 26
+        )
+        if header:
+            worksheet.append_row(header)
+        logger.info("Added sheet %r to %r", title, spreadsheet.title)
+        return worksheet
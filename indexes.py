@@ -0,0 +1,206 @@
+import bisect
+import re
+from collections import defaultdict
+
+
+class BookedIndex:
+    """Maps each Telegram user to the gifts they have booked.
+
+    Kept current from snapshot diffs and store write events, so "my booked"
+    is a lookup over the user's own gifts rather than a scan of the whole
+    wishlist.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._ids = defaultdict(set)  # owner key -> booked gift ids
+        self._owner = {}  # gift id -> owner key
+        self._gifts = {}  # gift id -> gift
+
+    @staticmethod
+    def owner_key(gift):
+        if gift["booker"]:
+            return gift["booker"]
+        # Booked before user ids were recorded
+        return f"name:{gift['status']}"
+
+    def refresh(self, rows, changed, removed):
+        """Snapshot listener: apply the gifts that changed since the last one."""
+        for gift_id in removed:
+            self._discard(gift_id)
+        for gift in changed:
+            self.apply("refresh", gift)
+        self.ready = True
+
+    def apply(self, event, gift):
+        """Store listener: update the index after a book/unbook."""
+        self._discard(gift["gift_id"])
+        if gift["status"]:
+            self._add(gift)
+
+    def gifts_for(self, user_id, user_name):
+        ids = self._ids.get(str(user_id), set()) | self._ids.get(
+            f"name:{user_name}", set()
+        )
+        gifts = [self._gifts[gift_id] for gift_id in ids]
+        return sorted(gifts, key=lambda gift: gift["row"])
+
+    def _add(self, gift):
+        key = self.owner_key(gift)
+        self._ids[key].add(gift["gift_id"])
+        self._owner[gift["gift_id"]] = key
+        self._gifts[gift["gift_id"]] = gift
+
+    def _discard(self, gift_id):
+        key = self._owner.pop(gift_id, None)
+        self._gifts.pop(gift_id, None)
+        if key is not None:
+            self._ids[key].discard(gift_id)
+            if not self._ids[key]:
+                del self._ids[key]
+
+
+def words(text):
+    return re.findall(r"\w+", text.casefold())
+
+
+class GiftSearchIndex:
+    """Finds free gifts by the beginnings of words in their names.
+
+    Every prefix of every word maps to the gifts containing it, so a query is
+    one dict lookup per typed word and an intersection; nothing is scanned
+    and the sheet is never asked. Kept current like ``BookedIndex``: from
+    snapshot diffs for names, and from store writes for who holds a gift.
+    """
+
+    MAX_PREFIX = 20  # longer words only match on their first letters
+
+    def __init__(self):
+        self.ready = False
+        self._ids = defaultdict(set)  # prefix -> gift ids
+        self._prefixes = {}  # gift id -> its prefixes
+        self._gifts = {}  # gift id -> gift
+
+    def refresh(self, rows, changed, removed):
+        """Snapshot listener: apply the gifts that changed since the last one."""
+        for gift_id in removed:
+            self._discard(gift_id)
+        for gift in changed:
+            self._discard(gift["gift_id"])
+            self._add(gift)
+        self.ready = True
+
+    def apply(self, event, gift):
+        """Store listener: a booking changes availability, not the name."""
+        if gift["gift_id"] in self._gifts:
+            self._gifts[gift["gift_id"]] = gift
+
+    def search(self, query):
+        """Free gifts matching every word of ``query``, in sheet order."""
+        ids = None
+        for word in words(query):
+            matches = self._ids.get(word[: self.MAX_PREFIX], set())
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+        # An empty query lists every free gift
+        candidates = self._gifts if ids is None else ids
+        gifts = [self._gifts[gift_id] for gift_id in candidates]
+        return sorted(
+            (gift for gift in gifts if not gift["status"]), key=lambda gift: gift["row"]
+        )
+
+    def _add(self, gift):
+        prefixes = {
+            word[:length]
+            for word in words(gift["gift_name"])
+            for length in range(1, min(len(word), self.MAX_PREFIX) + 1)
+        }
+        for prefix in prefixes:
+            self._ids[prefix].add(gift["gift_id"])
+        self._prefixes[gift["gift_id"]] = prefixes
+        self._gifts[gift["gift_id"]] = gift
+
+    def _discard(self, gift_id):
+        self._gifts.pop(gift_id, None)
+        for prefix in self._prefixes.pop(gift_id, ()):
+            self._ids[prefix].discard(gift_id)
+            if not self._ids[prefix]:
+                del self._ids[prefix]
+
+
+def join_thousands(text):
+    """Drop the spaces and commas that group digits, as in "1 200" or "1,200".
+
+    A comma counts as a separator only before exactly three digits; "99,90"
+    keeps its decimal comma.
+    """
+    return re.sub(r"(?<=\d)(?:\s+|,)(?=\d{3}(?!\d))", "", text)
+
+
+def parse_price(text):
+    """The number in a price cell such as "1 200 грн" or "99,90", or None."""
+    # Any comma left is the decimal point
+    match = re.search(r"\d+(?:[.,]\d+)?", join_thousands(text))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+class PriceIndex:
+    """Free gifts by price, for budget filters and cheapest/dearest first.
+
+    Prices are parsed once per gift when a snapshot brings it in or changes
+    it, and kept in a sorted list rebuilt after each snapshot refresh, so a
+    budget is two binary searches. Gifts whose price can't be read are left
+    out of ranges and listed last when only sorting.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._price = {}  # gift id -> parsed price or None
+        self._gifts = {}  # gift id -> gift
+        self._prices = []  # sorted prices
+        self._ids = []  # gift ids in the same order
+
+    def refresh(self, rows, changed, removed):
+        """Snapshot listener: re-parse changed gifts and re-sort."""
+        for gift_id in removed:
+            self._price.pop(gift_id, None)
+            self._gifts.pop(gift_id, None)
+        for gift in changed:
+            self._price[gift["gift_id"]] = parse_price(gift["price"])
+            self._gifts[gift["gift_id"]] = gift
+        if changed or removed or not self.ready:
+            priced = sorted(
+                (price, self._gifts[gift_id]["row"], gift_id)
+                for gift_id, price in self._price.items()
+                if price is not None
+            )
+            self._prices = [price for price, row, gift_id in priced]
+            self._ids = [gift_id for price, row, gift_id in priced]
+        self.ready = True
+
+    def apply(self, event, gift):
+        """Store listener: a booking changes availability, not the price."""
+        if gift["gift_id"] in self._gifts:
+            self._gifts[gift["gift_id"]] = gift
+
+    def select(self, low=None, high=None, descending=False):
+        """Free gifts priced within ``[low, high]``, cheapest first."""
+        start = 0 if low is None else bisect.bisect_left(self._prices, low)
+        end = len(self._ids)
+        if high is not None:
+            end = bisect.bisect_right(self._prices, high)
+        ids = self._ids[start:end]
+        if descending:
+            ids.reverse()
+        gifts = [self._gifts[gift_id] for gift_id in ids]
+        if low is None and high is None:
+            gifts += sorted(
+                (
+                    self._gifts[gift_id]
+                    for gift_id, price in self._price.items()
+                    if price is None
+                ),
+                key=lambda gift: gift["row"],
+            )
+        return [gift for gift in gifts if not gift["status"]]
@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import logging
+import random
+import sqlite3
+from datetime import datetime
+
+from shared import fail_fast, retry_busy
+from sync import is_retryable
+
+logger = logging.getLogger(__name__)
+
+LOG_SHEET_HEADER = ["at", "gift_id", "gift_name", "action", "user_name", "user_id"]
+
+
+class BookingJournal:
+    """Append-only record of every book and unbook, in SQLite.
+
+    Recording an event is a single ``INSERT`` however long a gift's history
+    is, and concurrent writers can't lose each other's entries the way they
+    could when rewriting one shared log cell. Events are kept per wishlist and
+    remember whether they have been copied to the spreadsheet yet.
+
+    Given the ``conn`` of a local store instead of a ``path``, the journal
+    lives in the store's database and an event is committed in the same
+    transaction as the booking it records. Otherwise writes give up at once
+    while another process holds the database, and callers retry them with
+    ``retry_busy``.
+    """
+
+    TABLE = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wishlist TEXT NOT NULL,
+            gift_id TEXT NOT NULL,
+            gift_name TEXT NOT NULL,
+            action TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            user_name TEXT NOT NULL,
+            at TEXT NOT NULL,
+            mirrored INTEGER NOT NULL DEFAULT 0
+        )
+    """
+
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS events_gift ON events (wishlist, gift_id);
+        CREATE INDEX IF NOT EXISTS events_unmirrored ON events (wishlist, id)
+            WHERE mirrored = 0;
+    """
+
+    def __init__(self, path=None, conn=None):
+        self._own_conn = conn is None
+        if conn is None:
+            conn = sqlite3.connect(path, isolation_level=None, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn = conn
+        self.conn.execute(self.TABLE)
+        self.conn.executescript(self.INDEXES)
+        if self._own_conn:
+            fail_fast(self.conn)
+
+    def record(self, wishlist, action, gift, user_id, user_name):
+        self.conn.execute(
+            """
+            INSERT INTO events
+                (wishlist, gift_id, gift_name, action, user_id, user_name, at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                wishlist,
+                gift["gift_id"],
+                gift["gift_name"],
+                action,
+                str(user_id),
+                user_name,
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            ),
+        )
+
+    def _select(self, where, params, order, limit):
+        cursor = self.conn.execute(
+            f"SELECT * FROM events WHERE {where} ORDER BY id {order} LIMIT ?",
+            (*params, -1 if limit is None else limit),
+        )
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, record)) for record in cursor]
+
+    def history(self, wishlist, gift_id, limit=20):
+        """The gift's latest ``limit`` events (all with ``None``), oldest first."""
+        events = self._select(
+            "wishlist = ? AND gift_id = ?", (wishlist, gift_id), "DESC", limit
+        )
+        return events[::-1]
+
+    def unmirrored(self, wishlist, limit=500):
+        return self._select("wishlist = ? AND mirrored = 0", (wishlist,), "", limit)
+
+    def mark_mirrored(self, wishlist, last_id):
+        self.conn.execute(
+            "UPDATE events SET mirrored = 1 "
+            "WHERE wishlist = ? AND mirrored = 0 AND id <= ?",
+            (wishlist, last_id),
+        )
+
+    def close(self):
+        if self._own_conn:
+            self.conn.close()
+
+
+class JournalMirror:
+    """Copies one wishlist's journal to a worksheet in batches.
+
+    New events are appended with a single ``append_rows`` call every
+    ``interval`` seconds, so the history stays readable in the spreadsheet
+    without growing any cell. Not waking up for each booking is deliberate:
+    every append changes the spreadsheet, which makes the change feed reload
+    it. Failures are retried with backoff; events stay unmirrored until the
+    sheet has accepted them.
+    """
+
+    def __init__(
+        self,
+        journal,
+        wishlist,
+        log_sheet,
+        interval=60.0,
+        batch_size=500,
+        max_backoff=300.0,
+        lock=None,
+    ):
+        self.journal = journal
+        self.wishlist = wishlist
+        self.log_sheet = log_sheet
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.lock = lock or contextlib.nullcontext
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            async with self.lock():
+                await self.flush()
+        except Exception:
+            logger.exception("Final journal mirror failed, events stay queued")
+
+    async def run(self):
+        delay = self.interval
+        failures = 0
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            try:
+                async with self.lock():
+                    while await self.flush():
+                        pass
+                failures = 0
+            except Exception as error:
+                failures += 1
+                delay = min(self.max_backoff, 2**failures) * random.uniform(0.5, 1)
+                if is_retryable(error):
+                    logger.warning(
+                        "Journal mirror failed (%r), retry in %.0fs", error, delay
+                    )
+                else:
+                    logger.exception("Journal mirror failed, retry in %.0fs", delay)
+
+    async def flush(self):
+        """Append one batch of events to the sheet; returns how many."""
+        events = self.journal.unmirrored(self.wishlist, self.batch_size)
+        if not events:
+            return 0
+        await self.log_sheet.append_rows(
+            [[event[column] for column in LOG_SHEET_HEADER] for event in events]
+        )
+        await retry_busy(self.journal.mark_mirrored, self.wishlist, events[-1]["id"])
+        return len(events)
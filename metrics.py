@@ -0,0 +1,250 @@
+import functools
+import time
+
+import tornado.httpserver
+import tornado.web
+
+# Seconds; wide enough for a cache hit and a slow Sheets call alike
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        if key not in self._children:
+            self._children[key] = self._new_child()
+        return self._children[key]
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._sample_lines(key, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(f"{name}_total", help_text, labelnames)
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def total(self):
+        """Sum over all label combinations."""
+        return sum(child.value for child in self._children.values())
+
+    def _sample_lines(self, key, child):
+        labels = _label_text(self.labelnames, key)
+        return [f"{self.name}{labels} {child.value:g}"]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def _sample_lines(self, key, child):
+        labels = _label_text(self.labelnames, key)
+        return [f"{self.name}{labels} {child.value:g}"]
+
+
+class _Timings:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.observe(time.perf_counter() - self.started)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _Timings(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _sample_lines(self, key, child):
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            labels = _label_text(names, key + (f"{bound:g}",))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _label_text(names, key + ("+Inf",))
+        lines.append(f"{self.name}_bucket{labels} {child.count}")
+        labels = _label_text(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {child.sum:g}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """All metrics of the process, rendered in Prometheus' text format.
+
+    Collectors are called just before rendering, so values kept elsewhere
+    (rate limiter counters, queue sizes) can be copied into gauges lazily.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def expose(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Time spent in each update handler", ["handler"]
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors", "Update handlers that raised", ["handler"]
+)
+SHEETS_SECONDS = REGISTRY.histogram(
+    "sheets_call_seconds", "Latency of gspread calls, queueing included", ["method"]
+)
+SHEETS_ERRORS = REGISTRY.counter(
+    "sheets_call_errors", "gspread calls that failed or timed out", ["method"]
+)
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "telegram_api_seconds", "Latency of Bot API calls", ["endpoint"]
+)
+TELEGRAM_RETRIES = REGISTRY.counter(
+    "telegram_api_retries", "Bot API calls retried by the rate limiter", ["reason"]
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "cache_lookups", "Cache lookups by cache and outcome", ["cache", "result"]
+)
+
+
+def timed_handler(callback):
+    """Wrap an update handler so its duration and failures are recorded."""
+    name = callback.__name__
+    timings = HANDLER_SECONDS.labels(handler=name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with timings.time():
+            try:
+                return await callback(update, context)
+            except Exception:
+                HANDLER_ERRORS.labels(handler=name).inc()
+                raise
+
+    return wrapper
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.registry.expose())
+
+
+def serve_metrics(port, path="/metrics", listen="0.0.0.0", registry=REGISTRY):
+    """Start an HTTP listener for ``path`` on the running event loop."""
+    app = tornado.web.Application(
+        [(path, MetricsHandler, {"registry": registry})], log_function=lambda h: None
+    )
+    server = tornado.httpserver.HTTPServer(app)
+    server.listen(port, address=listen)
+    return server
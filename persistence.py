@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import pickle
+import sqlite3
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from shared import fail_fast, is_busy, retry_busy
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a batch that found the database busy is tried again
+BUSY_RETRY_DELAY = 0.05
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps ``user_data`` and ``chat_data`` in a local SQLite file.
+
+    The application hands over changed entries every ``update_interval``
+    seconds; each such batch is written in one transaction rather than one
+    write per update. Nothing is read at startup: an entry is loaded the first
+    time its user or chat sends an update, so a large state file doesn't slow
+    down a cold start. Bot data, callback data and conversations aren't used
+    by this bot and are not stored.
+
+    With ``shared`` several processes use the same file: every entry carries
+    a version, and an entry another worker has written since is read again
+    before the next update for that user or chat is handled. A batch that
+    finds the file busy with another worker isn't waited for on the event
+    loop; it is tried again shortly, together with whatever came in since.
+    """
+
+    TABLE = """
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key)
+        )
+    """
+
+    def __init__(self, path, update_interval=60, shared=False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.TABLE)
+        columns = {
+            info[1] for info in self.conn.execute("PRAGMA table_info(persistence)")
+        }
+        if "version" not in columns:
+            self.conn.execute(
+                "ALTER TABLE persistence ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        fail_fast(self.conn)
+        self.shared = shared
+        self._loaded = {}  # (kind, key) merged into the app's data -> version
+        self._pending = {}  # (kind, key) -> pickled data, None to delete
+        self._write_scheduled = False
+
+    def _load(self, kind, key, data):
+        if (kind, key) in self._loaded and not self.shared:
+            return
+        if (kind, key) in self._pending:
+            return  # ours is newer than what is stored
+        record = self.conn.execute(
+            "SELECT data, version FROM persistence WHERE kind = ? AND key = ?",
+            (kind, key),
+        ).fetchone()
+        version = record[1] if record else None
+        if (kind, key) not in self._loaded:
+            if record is not None:
+                # Anything set before the entry was loaded is newer, keep it
+                data.update({**pickle.loads(record[0]), **data})
+        elif version != self._loaded[(kind, key)]:
+            # Another worker has written it since
+            data.clear()
+            if record is not None:
+                data.update(pickle.loads(record[0]))
+        self._loaded[(kind, key)] = version
+
+    def _queue(self, kind, key, data):
+        self._pending[(kind, key)] = None if data is None else pickle.dumps(data)
+        if not self._write_scheduled:
+            # The application updates all changed entries back to back, let
+            # them land in the same transaction
+            self._write_scheduled = True
+            asyncio.get_running_loop().call_soon(self._write)
+
+    def _write(self):
+        self._write_scheduled = False
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self._commit(pending)
+        except sqlite3.Error as error:
+            # Try again with the next batch unless newer data replaced it
+            self._pending = {**pending, **self._pending}
+            if not is_busy(error):
+                logger.exception("Saving %d persistence entries failed", len(pending))
+            elif not self._write_scheduled:
+                self._write_scheduled = True
+                asyncio.get_running_loop().call_later(BUSY_RETRY_DELAY, self._write)
+
+    def _commit(self, pending):
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            versions = {}
+            for (kind, key), data in pending.items():
+                if data is None:
+                    self.conn.execute(
+                        "DELETE FROM persistence WHERE kind = ? AND key = ?",
+                        (kind, key),
+                    )
+                    versions[(kind, key)] = None
+                    continue
+                self.conn.execute(
+                    """
+                    INSERT INTO persistence (kind, key, data) VALUES (?, ?, ?)
+                    ON CONFLICT (kind, key)
+                    DO UPDATE SET data = excluded.data, version = version + 1
+                    """,
+                    (kind, key, data),
+                )
+                versions[(kind, key)] = self.conn.execute(
+                    "SELECT version FROM persistence WHERE kind = ? AND key = ?",
+                    (kind, key),
+                ).fetchone()[0]
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+        self._loaded.update(versions)
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_user_data(self, user_id, data):
+        self._queue("user", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._queue("chat", chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._queue("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._queue("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._load("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        self._load("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            await retry_busy(self._commit, pending)
+        self.conn.close()
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import TELEGRAM_RETRIES, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per ``period`` seconds, with bursts up to ``burst``.
+
+    Callers that have to wait queue up in FIFO order on the bucket's lock.
+    """
+
+    def __init__(self, rate, period=1.0, burst=None):
+        self.capacity = burst or rate
+        self.fill_rate = rate / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
+        self.updated = now
+
+    def delay(self):
+        """Roughly how long an ``acquire`` now would wait, in seconds."""
+        self._refill()
+        queued = 1 if self._lock.locked() else 0
+        return max(0.0, (1 + queued - self.tokens) / self.fill_rate)
+
+    def is_idle(self):
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class FloodControlLimiter(BaseRateLimiter[int]):
+    """Outbound request scheduler that keeps the bot inside Telegram's limits.
+
+    Requests addressed to a chat pass through that chat's bucket (about one
+    message a second in private chats, 20 a minute in groups) and then the
+    bot-wide bucket (30 a second). ``RetryAfter`` pauses the affected chat, or
+    the whole bot for requests without a chat, and the request is retried up to
+    ``max_retries`` times. Transient network errors are retried with a short
+    exponential backoff. ``stats()`` reports queue depth and waiting times;
+    ``chat_delay(chat_id)`` says how long a request to a chat would wait.
+    """
+
+    def __init__(
+        self,
+        overall_rate=30,
+        chat_rate=1,
+        chat_burst=3,
+        group_rate=20,
+        group_period=60,
+        max_retries=3,
+        network_retries=2,
+    ):
+        self.overall = TokenBucket(overall_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_period = group_period
+        self.max_retries = max_retries
+        self.network_retries = network_retries
+        self._chats = {}
+        self._paused_until = {}  # chat id (None = everyone) -> monotonic time
+        self.depth = 0
+        self.counters = {
+            "requests": 0,
+            "retry_after": 0,
+            "network_retries": 0,
+            "max_depth": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {**self.counters, "depth": self.depth, "chats": len(self._chats)}
+
+    def _chat_bucket(self, chat_id):
+        # Forget chats whose bucket is full again, like nothing happened there
+        if len(self._chats) > 512:
+            for key, bucket in list(self._chats.items()):
+                if key != chat_id and bucket.is_idle():
+                    del self._chats[key]
+
+        if chat_id not in self._chats:
+            # Negative ids (and @usernames) are groups and channels
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_period)
+            else:
+                bucket = TokenBucket(self.chat_rate, burst=self.chat_burst)
+            self._chats[chat_id] = bucket
+        return self._chats[chat_id]
+
+    def chat_delay(self, chat_id):
+        """Seconds before a request to ``chat_id`` would go out, about."""
+        now = time.monotonic()
+        until = max(self._paused_until.get(key, now) for key in (None, chat_id))
+        bucket = self._chats.get(chat_id)
+        return max(until - now, bucket.delay() if bucket else 0.0)
+
+    async def _wait_paused(self, key):
+        until = self._paused_until.get(key)
+        while until is not None:
+            delay = until - time.monotonic()
+            if delay <= 0:
+                if self._paused_until.get(key) == until:
+                    del self._paused_until[key]
+                return
+            await asyncio.sleep(delay)
+            until = self._paused_until.get(key)
+
+    async def _wait_for_turn(self, chat_id):
+        await self._wait_paused(None)
+        if chat_id is None:
+            return
+        await self._wait_paused(chat_id)
+        await self._chat_bucket(chat_id).acquire()
+        await self.overall.acquire()
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        try:
+            # In case an integer chat id was passed as a string
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        self.counters["requests"] += 1
+        flood_retries = network_retries = 0
+        while True:
+            queued_at = time.monotonic()
+            self.depth += 1
+            self.counters["max_depth"] = max(self.counters["max_depth"], self.depth)
+            try:
+                await self._wait_for_turn(chat_id)
+            finally:
+                self.depth -= 1
+            waited = time.monotonic() - queued_at
+            self.counters["wait_seconds_total"] += waited
+            self.counters["wait_seconds_max"] = max(
+                self.counters["wait_seconds_max"], waited
+            )
+
+            try:
+                with TELEGRAM_SECONDS.labels(endpoint=endpoint).time():
+                    return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                self.counters["retry_after"] += 1
+                TELEGRAM_RETRIES.labels(reason="retry_after").inc()
+                retry_after = exc.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                # Also when giving up, so other requests wait it out
+                self._paused_until[chat_id] = time.monotonic() + retry_after + 0.1
+                if flood_retries >= max_retries:
+                    raise
+                flood_retries += 1
+                logger.info(
+                    "Flood control on %s for chat %s, retrying in %ss",
+                    endpoint,
+                    chat_id,
+                    retry_after,
+                )
+            except NetworkError as exc:
+                # BadRequest is a NetworkError too, but retrying won't fix it
+                if isinstance(exc, BadRequest):
+                    raise
+                if network_retries >= self.network_retries:
+                    raise
+                self.counters["network_retries"] += 1
+                TELEGRAM_RETRIES.labels(reason="network").inc()
+                network_retries += 1
+                logger.warning("%s failed (%s), retrying", endpoint, exc)
+                await asyncio.sleep(0.5 * 2**network_retries)
@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import os
+import secrets
+import socket
+import sqlite3
+import time
+
+# Writers on the event loop wait at most this long (ms) for another process
+# to release the database, then retry asynchronously with ``retry_busy``
+BUSY_TIMEOUT_MS = 20
+
+
+class LeaseTimeout(Exception):
+    """Another worker held the lease for longer than we were willing to wait."""
+
+
+class LeaseLost(Exception):
+    """The lease ran out and another worker has taken it since."""
+
+
+def is_busy(error):
+    """Whether ``error`` means another connection holds the write lock."""
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def fail_fast(conn):
+    """Make writes on ``conn`` give up after ``BUSY_TIMEOUT_MS`` when busy."""
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+
+async def retry_busy(func, *args, timeout=5.0, **kwargs):
+    """Call ``func``, a short SQLite write, until the database isn't busy.
+
+    Used with connections set up by ``fail_fast``: instead of blocking the
+    event loop in SQLite's busy handler while another process writes, the
+    caller sleeps between attempts. Gives up after ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as error:
+            if not is_busy(error) or time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+
+class SharedState:
+    """Coordination between several bot processes through one SQLite file.
+
+    ``bump``/``version`` are counters that tell a worker another one has
+    written, so it can drop its cached snapshot. ``lease`` is a lock with an
+    expiry: if the worker holding it dies, the lease runs out after ``ttl``
+    seconds instead of blocking everyone forever; a holder that may take
+    longer renews it with the function the lease yields. All workers must open the
+    same file on a local disk of one host: WAL mode relies on shared memory
+    and file locks that network file systems don't provide.
+
+    Calls run on the event loop, so a busy database is never waited for
+    there: a lease attempt counts as failed and is retried, and a bump that
+    can't be written right away is retried in the background.
+    """
+
+    TABLES = """
+        CREATE TABLE IF NOT EXISTS versions (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.TABLES)
+        fail_fast(self.conn)
+        self._retries = set()
+
+    def version(self, key):
+        record = self.conn.execute(
+            "SELECT version FROM versions WHERE key = ?", (key,)
+        ).fetchone()
+        return record[0] if record else 0
+
+    def bump(self, key):
+        try:
+            self._bump(key)
+        except sqlite3.OperationalError as error:
+            if not is_busy(error):
+                raise
+            # Don't hold up the write that bumped; the others see it shortly
+            task = asyncio.get_running_loop().create_task(retry_busy(self._bump, key))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    def _bump(self, key):
+        self.conn.execute(
+            """
+            INSERT INTO versions (key, version) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1
+            """,
+            (key,),
+        )
+
+    def _try_acquire(self, key, ttl):
+        now = time.time()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as error:
+            if is_busy(error):
+                return False  # somebody is writing, maybe taking this very key
+            raise
+        try:
+            self.conn.execute(
+                "DELETE FROM leases WHERE key = ? AND expires < ?", (key, now)
+            )
+            acquired = self.conn.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                (key, self.owner, now + ttl),
+            ).rowcount
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return bool(acquired)
+
+    def _release(self, key):
+        self.conn.execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner)
+        )
+
+    def _renew(self, key, ttl):
+        # Our row is only gone if the lease expired and someone else took it
+        renewed = self.conn.execute(
+            "UPDATE leases SET expires = ? WHERE key = ? AND owner = ?",
+            (time.time() + ttl, key, self.owner),
+        ).rowcount
+        if not renewed:
+            raise LeaseLost(key)
+
+    def claim(self, key, ttl):
+        """Take ``key`` for ``ttl`` seconds unless another worker holds it.
+
+        Doesn't wait and isn't released: the first worker to claim, say, a
+        notification sends it and the others skip it. A busy database counts
+        as claimed by someone else.
+        """
+        return self._try_acquire(key, ttl)
+
+    @contextlib.asynccontextmanager
+    async def lease(self, key, ttl=30.0, timeout=30.0):
+        """Hold ``key`` exclusively among all workers for the ``async with``.
+
+        Yields an async ``renew()``, which gives the lease another ``ttl``
+        seconds and raises ``LeaseLost`` if it is not ours any more. Call it
+        right before a write that must not overlap with another holder's.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not self._try_acquire(key, ttl):
+            if time.monotonic() > deadline:
+                raise LeaseTimeout(key)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+        async def renew():
+            await retry_busy(self._renew, key, ttl)
+
+        try:
+            yield renew
+        finally:
+            await retry_busy(self._release, key)
+
+    def close(self):
+        self.conn.close()
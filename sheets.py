@@ -0,0 +1,113 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from gspread.utils import rowcol_to_a1
+
+from metrics import SHEETS_ERRORS, SHEETS_SECONDS
+
+
+class AsyncSheet:
+    """Awaitable wrapper around a gspread ``Worksheet``.
+
+    gspread is synchronous, so every call runs on a small dedicated thread
+    pool. ``max_in_flight`` caps how many requests may be queued or running at
+    once and ``timeout`` bounds how long a handler waits for a single call,
+    and separately for the quota to let it through; a lock held around a
+    call is held for at most twice that. A timed out call keeps its worker
+    thread until gspread returns, but the handler that issued it is released.
+
+    Instead of a worksheet, an async ``opener`` may be given; it is awaited on
+    the first call, so nothing talks to Google before it is actually needed.
+
+    Several sheets can share one thread pool through ``executor``. A
+    ``quota`` token bucket, if given, limits how many calls this sheet may
+    make, so one busy spreadsheet can't use up the whole project's quota.
+    """
+
+    def __init__(
+        self,
+        worksheet=None,
+        opener=None,
+        max_workers=4,
+        max_in_flight=8,
+        timeout=15.0,
+        executor=None,
+        quota=None,
+    ):
+        self.worksheet = worksheet
+        self.opener = opener
+        self.timeout = timeout
+        self.quota = quota
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sheets"
+        )
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._open_lock = asyncio.Lock()
+
+    async def _worksheet(self):
+        if self.worksheet is None:
+            async with self._open_lock:
+                if self.worksheet is None:
+                    self.worksheet = await self.opener()
+        return self.worksheet
+
+    async def call(self, method, *args, **kwargs):
+        worksheet = await self._worksheet()
+        func = functools.partial(getattr(worksheet, method), *args, **kwargs)
+        return await self._run(method, func)
+
+    async def _run(self, method, func):
+        with SHEETS_SECONDS.labels(method=method).time():
+            try:
+                if self.quota:
+                    await asyncio.wait_for(self.quota.acquire(), self.timeout)
+                async with self._in_flight:
+                    loop = asyncio.get_running_loop()
+                    future = loop.run_in_executor(self._executor, func)
+                    return await asyncio.wait_for(future, self.timeout)
+            except Exception:
+                SHEETS_ERRORS.labels(method=method).inc()
+                raise
+
+    async def cell(self, row, col):
+        return await self.call("cell", row, col)
+
+    async def update_cell(self, row, col, value):
+        return await self.call("update_cell", row, col, value)
+
+    async def row_values(self, row):
+        return await self.call("row_values", row)
+
+    async def col_values(self, col):
+        return await self.call("col_values", col)
+
+    async def get_all_values(self):
+        return await self.call("get_all_values")
+
+    async def get_all_records(self):
+        return await self.call("get_all_records")
+
+    async def batch_update(self, data):
+        return await self.call("batch_update", data)
+
+    async def append_rows(self, values):
+        return await self.call("append_rows", values, value_input_option="RAW")
+
+    async def last_update_time(self):
+        """Drive's ``modifiedTime`` of the spreadsheet, a cheap change check."""
+        spreadsheet = (await self._worksheet()).spreadsheet
+        return await self._run("get_lastUpdateTime", spreadsheet.get_lastUpdateTime)
+
+    async def write_cells(self, row, col, values):
+        """Write ``values`` into consecutive cells of ``row`` starting at ``col``."""
+        first = rowcol_to_a1(row, col)
+        last = rowcol_to_a1(row, col + len(values) - 1)
+        return await self.batch_update(
+            [{"range": f"{first}:{last}", "values": [values]}]
+        )
+
+    def shutdown(self):
+        if self._own_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
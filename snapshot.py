@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from metrics import CACHE_LOOKUPS
+
+
+def diff_gifts(old, new):
+    """Gifts added or edited in ``new``, and ids of gifts missing from it."""
+    before = {gift["gift_id"]: gift for gift in old}
+    changed = [gift for gift in new if before.get(gift["gift_id"]) != gift]
+    current = {gift["gift_id"] for gift in new}
+    removed = [gift_id for gift_id in before if gift_id not in current]
+    return changed, removed
+
+
+class SnapshotCache:
+    """In-process, versioned copy of the wishlist rows.
+
+    Rows are reloaded at most once per ``ttl`` seconds. Concurrent callers that
+    miss the cache await the same refresh instead of each hitting the API.
+    The returned rows are shared between callers and must not be mutated.
+
+    ``stamp``, if given, is called on every lookup; when its value differs
+    from the one taken before the last load (say, another worker wrote to
+    the shared store), the rows are reloaded before the ``ttl`` runs out.
+    """
+
+    def __init__(self, loader, ttl=30.0, stamp=None):
+        self._loader = loader  # async callable returning the list of rows
+        self.ttl = ttl
+        self._stamp = stamp
+        self._loaded_stamp = None
+        self.version = 0
+        self._rows = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._refresh = None
+        self._listeners = []
+        self._published = []  # rows the listeners saw last
+
+    def add_listener(self, listener):
+        """Call ``listener(rows, changed, removed)`` on every fresh snapshot.
+
+        ``changed`` lists gifts that are new or differ from the previous
+        snapshot and ``removed`` the ids that disappeared, so listeners can
+        update incrementally. The first snapshot reports every gift as new.
+        """
+        self._listeners.append(listener)
+
+    def is_fresh(self):
+        if self._rows is None or time.monotonic() - self._loaded_at >= self.ttl:
+            return False
+        return self._stamp is None or self._stamp() == self._loaded_stamp
+
+    def shared_changed(self):
+        """Whether ``stamp`` has moved since the rows were loaded.
+
+        Unlike ``is_fresh`` this ignores the ``ttl`` and ``invalidate``, for
+        callers whose own writes already reach them through store listeners.
+        """
+        return self._stamp is not None and self._stamp() != self._loaded_stamp
+
+    async def get(self):
+        if self.is_fresh():
+            CACHE_LOOKUPS.labels(cache="snapshot", result="hit").inc()
+            return self._rows
+        if self._refresh is None:
+            CACHE_LOOKUPS.labels(cache="snapshot", result="miss").inc()
+            self._refresh = asyncio.ensure_future(self._reload())
+        else:
+            # Joined a refresh somebody else started
+            CACHE_LOOKUPS.labels(cache="snapshot", result="shared").inc()
+        # Shield so that a cancelled caller doesn't cancel everyone's refresh
+        return await asyncio.shield(self._refresh)
+
+    def invalidate(self):
+        """Drop the cached rows after the bot has written to the sheet."""
+        self._generation += 1
+        self._loaded_at = 0.0
+
+    async def _reload(self):
+        generation = self._generation
+        stamp = self._stamp() if self._stamp else None
+        try:
+            rows = await self._loader()
+            self._rows = rows
+            self.version += 1
+            # A write that landed while we were loading makes these rows
+            # stale already, so hand them out once but don't cache them.
+            if generation == self._generation:
+                self._loaded_at = time.monotonic()
+                self._loaded_stamp = stamp
+                changed, removed = diff_gifts(self._published, rows)
+                self._published = rows
+                for listener in self._listeners:
+                    listener(rows, changed, removed)
+            return rows
+        finally:
+            self._refresh = None
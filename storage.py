@@ -0,0 +1,458 @@
+import contextlib
+import secrets
+import sqlite3
+
+from gspread.utils import rowcol_to_a1
+
+from booking import BookingEngine, StaleRow, row_cell
+from shared import fail_fast, retry_busy
+
+
+class TableHeaders:
+    gift_name = 1
+    price = 2
+    link = 3
+    status = 4
+
+
+class CellHeaders:
+    gift_name = 2
+    price = 3
+    link = 4
+    status = 5
+    log = 6
+    booker = 7  # Telegram user id of whoever booked the gift
+    gift_id = 8  # Assigned by the bot, survives sorting and inserting rows
+
+
+GIFT_FIELDS = ("gift_name", "price", "link", "status", "log", "booker", "gift_id")
+
+
+def gift_from_row(row_num, row):
+    gift = {"row": row_num}
+    for field in GIFT_FIELDS:
+        gift[field] = str(row_cell(row, getattr(CellHeaders, field)))
+    return gift
+
+
+def new_gift_id():
+    return secrets.token_hex(4)
+
+
+class GiftStore:
+    """Storage backend interface used by the handlers.
+
+    A gift is a dict with ``row`` (its current spreadsheet row) and the
+    ``GIFT_FIELDS``; it is addressed by ``gift_id``, which stays the same when
+    rows move. ``book``/``unbook`` return ``(changed, gift)``, where ``gift``
+    is the state after the write, or the state that blocked it, or ``None``
+    if there is no such gift (any more).
+    Listeners registered with ``add_listener`` are called as
+    ``listener(event, gift)`` after every successful write. If ``journal``
+    is set, each write is also recorded as ``journal(event, gift, user_id,
+    user_name)`` while it still excludes other writers of that gift, so the
+    journal has a gift's events in the order they happened.
+    ``log`` is the legacy history column, which the bot no longer writes.
+
+    ``status`` is the booker's display name, ``booker`` their Telegram user
+    id; ownership is decided by the id.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self.journal = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _record(self, event, gift, user_id, user_name):
+        if self.journal:
+            self.journal(event, gift, user_id, user_name)
+
+    def _notify(self, event, gift):
+        for listener in self._listeners:
+            listener(event, gift)
+
+    async def list_gifts(self):
+        raise NotImplementedError
+
+    async def get_gift(self, gift_id):
+        raise NotImplementedError
+
+    async def book(self, gift_id, user_id, user_name):
+        raise NotImplementedError
+
+    async def unbook(self, gift_id, user_id, user_name):
+        raise NotImplementedError
+
+
+class SheetsStore(GiftStore):
+    """Google Sheets backend; every call is a Sheets API round-trip.
+
+    ``list_gifts`` hands out ids to rows that don't have one yet and rebuilds
+    the id -> row map, so handlers find a gift's row without asking Google.
+    The map is the one behind the wishlist's snapshot: an id it doesn't know
+    is not in the sheet, and is answered without a reload. A write that
+    finds a different gift in that row refreshes the map once and tries
+    again. ``lease`` is handed to the booking engine for running
+    several bot processes against one sheet.
+    """
+
+    def __init__(self, sheet_api, lease=None):
+        super().__init__()
+        self.sheet_api = sheet_api
+        self.rows = None  # gift id -> row, as of the last list_gifts
+        self.engine = BookingEngine(
+            sheet_api,
+            status_col=CellHeaders.status,
+            booker_col=CellHeaders.booker,
+            id_col=CellHeaders.gift_id,
+            lease=lease,
+        )
+
+    async def list_gifts(self):
+        values = await self.sheet_api.get_all_values()
+        # Start at 2 to account for header row
+        gifts = [
+            gift_from_row(row_num, row)
+            for row_num, row in enumerate(values[1:], start=2)
+            if any(row)
+        ]
+
+        rows, missing = {}, []
+        for gift in gifts:
+            # A copied row brings its id along, the copy needs a new one
+            if not gift["gift_id"] or gift["gift_id"] in rows:
+                gift["gift_id"] = new_gift_id()
+                missing.append(gift)
+            rows[gift["gift_id"]] = gift["row"]
+        if missing:
+            await self.sheet_api.batch_update(
+                [
+                    {
+                        "range": rowcol_to_a1(gift["row"], CellHeaders.gift_id),
+                        "values": [[gift["gift_id"]]],
+                    }
+                    for gift in missing
+                ]
+            )
+        self.rows = rows
+        return gifts
+
+    async def _run(self, gift_id, operation):
+        if self.rows is None:
+            await self.list_gifts()
+        for attempt in range(2):
+            if attempt:
+                await self.list_gifts()
+            row_num = self.rows.get(gift_id)
+            if row_num is None:
+                return None
+            try:
+                return await operation(row_num)
+            except StaleRow:
+                continue
+        return None
+
+    async def _journal(self, event, gift, user_id, user_name):
+        # Still under the gift's lease, so the events stay in order; the
+        # journal's own database may be busy with another process
+        await retry_busy(self._record, event, gift, user_id, user_name)
+
+    async def get_gift(self, gift_id):
+        async def read(row_num):
+            row = await self.sheet_api.row_values(row_num)
+            if row_cell(row, CellHeaders.gift_id) != gift_id:
+                raise StaleRow(row_num)
+            return gift_from_row(row_num, row)
+
+        return await self._run(gift_id, read)
+
+    async def book(self, gift_id, user_id, user_name):
+        async def book_row(row_num):
+            booked, row = await self.engine.book(
+                row_num,
+                gift_id,
+                user_id,
+                user_name,
+                on_success=lambda row: self._journal(
+                    "book", gift_from_row(row_num, row), user_id, user_name
+                ),
+            )
+            return booked, gift_from_row(row_num, row)
+
+        booked, gift = await self._run(gift_id, book_row) or (False, None)
+        if booked:
+            self._notify("book", gift)
+        return booked, gift
+
+    async def unbook(self, gift_id, user_id, user_name):
+        async def unbook_row(row_num):
+            unbooked, row = await self.engine.unbook(
+                row_num,
+                gift_id,
+                user_id,
+                user_name,
+                on_success=lambda row: self._journal(
+                    "unbook", gift_from_row(row_num, row), user_id, user_name
+                ),
+            )
+            return unbooked, gift_from_row(row_num, row)
+
+        unbooked, gift = await self._run(gift_id, unbook_row) or (False, None)
+        if unbooked:
+            self._notify("unbook", gift)
+        return unbooked, gift
+
+
+class SQLiteStore(GiftStore):
+    """Local SQLite backend in WAL mode.
+
+    Queries are indexed and take well under a millisecond, so they run on the
+    event loop directly. A booking is a single conditional ``UPDATE`` inside a
+    transaction, which makes the check-then-write atomic without extra locks.
+    ``row`` only records where the gift lives in the sheet, for syncing.
+    When several processes share the file, writes don't wait for each other
+    on the event loop; the async methods retry them with ``retry_busy``, and
+    callers of the plain ones (``import_gifts``, ``ack_changes``) should too.
+    """
+
+    GIFTS_TABLE = """
+        CREATE TABLE IF NOT EXISTS gifts (
+            gift_id TEXT NOT NULL DEFAULT '',
+            row INTEGER NOT NULL,
+            gift_name TEXT NOT NULL DEFAULT '',
+            price TEXT NOT NULL DEFAULT '',
+            link TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT '',
+            booker TEXT NOT NULL DEFAULT '',
+            log TEXT NOT NULL DEFAULT ''
+        )
+    """
+
+    # Gifts changed locally that still have to be written to the sheet; row
+    # is where the gift was when queued, log is no longer synced and stays empty
+    OUTBOX_TABLE = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            row INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            log TEXT NOT NULL,
+            booker TEXT NOT NULL DEFAULT '',
+            gift_id TEXT NOT NULL DEFAULT ''
+        )
+    """
+
+    INDEXES = """
+        CREATE UNIQUE INDEX IF NOT EXISTS gifts_gift_id ON gifts (gift_id)
+            WHERE gift_id != '';
+        CREATE INDEX IF NOT EXISTS gifts_row ON gifts (row);
+        CREATE INDEX IF NOT EXISTS gifts_status ON gifts (status);
+        CREATE INDEX IF NOT EXISTS gifts_booker ON gifts (booker);
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.GIFTS_TABLE)
+        self.conn.execute(self.OUTBOX_TABLE)
+        self._migrate()
+        self.conn.executescript(self.INDEXES)
+        fail_fast(self.conn)
+
+    def _columns(self, table):
+        return {
+            info["name"] for info in self.conn.execute(f"PRAGMA table_info({table})")
+        }
+
+    def _migrate(self):
+        # Outbox tables created before booker ids were tracked
+        if "booker" not in self._columns("outbox"):
+            self.conn.execute(
+                "ALTER TABLE outbox ADD COLUMN booker TEXT NOT NULL DEFAULT ''"
+            )
+        # Outbox tables that only knew the row
+        if "gift_id" not in self._columns("outbox"):
+            self.conn.execute(
+                "ALTER TABLE outbox ADD COLUMN gift_id TEXT NOT NULL DEFAULT ''"
+            )
+        # Gifts tables keyed by row: rebuild them, ids arrive with the next import
+        if "gift_id" not in self._columns("gifts"):
+            with self.transaction():
+                self.conn.execute("ALTER TABLE gifts RENAME TO gifts_by_row")
+                self.conn.execute(self.GIFTS_TABLE)
+                self.conn.execute(
+                    """
+                    INSERT INTO gifts (row, gift_name, price, link, status, booker, log)
+                    SELECT row, gift_name, price, link, status, booker, log
+                    FROM gifts_by_row
+                    """
+                )
+                self.conn.execute("DROP TABLE gifts_by_row")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _from_record(record):
+        return {"row": record["row"], **{field: record[field] for field in GIFT_FIELDS}}
+
+    def _gift(self, gift_id):
+        record = self.conn.execute(
+            "SELECT * FROM gifts WHERE gift_id = ?", (gift_id,)
+        ).fetchone()
+        return self._from_record(record) if record else None
+
+    async def list_gifts(self):
+        records = self.conn.execute(
+            "SELECT * FROM gifts WHERE gift_id != '' ORDER BY row"
+        ).fetchall()
+        return [self._from_record(record) for record in records]
+
+    async def get_gift(self, gift_id):
+        return self._gift(gift_id)
+
+    # Same ownership rule as BookingEngine.owns()
+    OWNED = """
+        (booker = :user_id OR (booker = '' AND status = :user_name))
+    """
+
+    def _set_status(self, event, gift_id, status, booker, condition, user):
+        with self.transaction():
+            changed = self.conn.execute(
+                f"""
+                UPDATE gifts SET status = :status, booker = :booker
+                WHERE gift_id = :gift_id AND {condition}
+                """,
+                {
+                    "status": status,
+                    "booker": booker,
+                    "gift_id": gift_id,
+                    "user_id": str(user[0]),
+                    "user_name": user[1],
+                },
+            ).rowcount
+            if changed:
+                self._enqueue(gift_id)
+                # Committed together with the booking, see BookingJournal
+                self._record(event, self._gift(gift_id), *user)
+        return bool(changed)
+
+    async def book(self, gift_id, user_id, user_name):
+        booked = await retry_busy(
+            self._set_status,
+            "book",
+            gift_id,
+            user_name,
+            str(user_id),
+            condition=f"(status = '' OR {self.OWNED})",
+            user=(user_id, user_name),
+        )
+        gift = self._gift(gift_id)
+        if booked:
+            self._notify("book", gift)
+        return booked, gift
+
+    async def unbook(self, gift_id, user_id, user_name):
+        unbooked = await retry_busy(
+            self._set_status,
+            "unbook",
+            gift_id,
+            "",
+            "",
+            condition=f"(status != '' AND {self.OWNED})",
+            user=(user_id, user_name),
+        )
+        gift = self._gift(gift_id)
+        if unbooked:
+            self._notify("unbook", gift)
+        return unbooked, gift
+
+    def _enqueue(self, gift_id):
+        # Called inside the write's transaction, so the queue is never behind
+        self.conn.execute(
+            """
+            INSERT INTO outbox (gift_id, row, status, log, booker)
+            SELECT gift_id, row, status, '', booker FROM gifts WHERE gift_id = ?
+            """,
+            (gift_id,),
+        )
+
+    def pending_changes(self, limit=500):
+        """Oldest queued sheet updates as ``(id, gift_id, row, status, booker)``."""
+        return self.conn.execute(
+            "SELECT id, gift_id, row, status, booker FROM outbox ORDER BY id LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def ack_changes(self, last_id):
+        with self.transaction():
+            self.conn.execute("DELETE FROM outbox WHERE id <= ?", (last_id,))
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM gifts LIMIT 1").fetchone() is None
+
+    def import_gifts(self, gifts):
+        """Insert or refresh gifts from the sheet.
+
+        Gifts are matched by id, or by row for local gifts that predate ids.
+        Name, price, link and row come from the sheet; booking state and log
+        stay local, since the sheet may not have caught up with them yet.
+        Gifts whose ids are no longer in the sheet were deleted there; they
+        are deleted here too, along with their queued changes.
+        """
+        with self.transaction():
+            gone = {
+                gift_id
+                for gift_id, in self.conn.execute(
+                    "SELECT gift_id FROM gifts WHERE gift_id != ''"
+                )
+            }
+            gone -= {gift["gift_id"] for gift in gifts}
+            for table in ("gifts", "outbox"):
+                self.conn.executemany(
+                    f"DELETE FROM {table} WHERE gift_id = ?",
+                    [(gift_id,) for gift_id in gone],
+                )
+            for gift in gifts:
+                params = {field: gift[field] for field in GIFT_FIELDS}
+                params["row"] = gift["row"]
+                for match in (
+                    "gift_id = :gift_id",
+                    "gift_id = '' AND row = :row",
+                ):
+                    changed = self.conn.execute(
+                        f"""
+                        UPDATE gifts
+                        SET gift_id = :gift_id, row = :row, gift_name = :gift_name,
+                            price = :price, link = :link
+                        WHERE {match}
+                        """,
+                        params,
+                    ).rowcount
+                    if changed:
+                        break
+                else:
+                    self.conn.execute(
+                        """
+                        INSERT INTO gifts
+                            (gift_id, row, gift_name, price, link, status, booker, log)
+                        VALUES (:gift_id, :row, :gift_name, :price, :link,
+                                :status, :booker, :log)
+                        """,
+                        params,
+                    )
+
+    def close(self):
+        self.conn.close()
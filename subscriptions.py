@@ -0,0 +1,266 @@
+import asyncio
+import collections
+import logging
+import sqlite3
+
+from telegram.error import Forbidden, RetryAfter
+
+from ratelimit import TokenBucket
+from shared import fail_fast
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class Subscriptions:
+    """Chats that want to hear when gifts of their wishlist become available.
+
+    One row per chat, holding the wishlist it follows; ``follow`` moves a
+    subscribed chat along when it switches wishlists. Writes give up at once
+    while another process holds the database; callers retry them with
+    ``retry_busy``.
+    """
+
+    TABLE = """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            wishlist TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS subscriptions_wishlist
+            ON subscriptions (wishlist);
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.TABLE)
+        fail_fast(self.conn)
+
+    def add(self, chat_id, wishlist):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO subscriptions (chat_id, wishlist) VALUES (?, ?)",
+            (chat_id, wishlist),
+        )
+
+    def remove(self, chat_id):
+        """Unsubscribe ``chat_id``; returns whether it was subscribed."""
+        return bool(
+            self.conn.execute(
+                "DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,)
+            ).rowcount
+        )
+
+    def follow(self, chat_id, wishlist):
+        self.conn.execute(
+            "UPDATE subscriptions SET wishlist = ? WHERE chat_id = ?",
+            (wishlist, chat_id),
+        )
+
+    def chats(self, wishlist):
+        return [
+            chat_id
+            for chat_id, in self.conn.execute(
+                "SELECT chat_id FROM subscriptions WHERE wishlist = ?", (wishlist,)
+            )
+        ]
+
+    def close(self):
+        self.conn.close()
+
+
+class AvailabilityWatch:
+    """Notices gifts of one wishlist becoming available, and reports them in batches.
+
+    A gift counts when someone releases it through the bot (store
+    listener), or when a snapshot shows it newly added or released by hand
+    in the sheet (snapshot listener). The first change starts a ``delay``
+    second window; everything noticed until it ends is passed to
+    ``report(items)`` at once, as ``(kind, gift)`` pairs with kind "added" or
+    "freed". Gifts booked again within the window are dropped.
+
+    With ``claim(key)`` several bot processes watch the same wishlist: only
+    the one whose claim succeeds reports a new gift, and releases seen in the
+    sheet are left out, since they may be another process's (already
+    reported) bookings.
+    """
+
+    def __init__(self, report, delay=60.0, claim=None):
+        self.report = report
+        self.delay = delay
+        self.claim = claim
+        self._ready = False
+        self._status = {}  # gift id -> status in the last snapshot or write
+        self._pending = {}  # gift id -> (kind, gift)
+        self._timer = None
+
+    def refresh(self, rows, changed, removed):
+        """Snapshot listener."""
+        for gift_id in removed:
+            self._status.pop(gift_id, None)
+            self._pending.pop(gift_id, None)
+        for gift in changed:
+            gift_id = gift["gift_id"]
+            before = self._status.get(gift_id, MISSING)
+            self._status[gift_id] = gift["status"]
+            if not self._ready:
+                continue  # everything is new in the first snapshot
+            if gift["status"]:
+                self._pending.pop(gift_id, None)
+            elif before is MISSING:
+                if self.claim is None or self.claim(f"added:{gift_id}"):
+                    self._add("added", gift)
+            elif before and self.claim is None:
+                self._add("freed", gift)
+            elif gift_id in self._pending:
+                self._add(self._pending[gift_id][0], gift)  # edited meanwhile
+        self._ready = True
+
+    def apply(self, event, gift):
+        """Store listener."""
+        self._status[gift["gift_id"]] = gift["status"]
+        if event == "unbook":
+            self._add("freed", gift)
+        else:
+            self._pending.pop(gift["gift_id"], None)
+
+    def _add(self, kind, gift):
+        # A gift added and then released is still news as "added"
+        kind = self._pending.get(gift["gift_id"], (kind,))[0]
+        self._pending[gift["gift_id"]] = kind, gift
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = list(self._pending.values()), {}
+        if items:
+            self.report(items)
+
+
+class Broadcaster:
+    """Delivers digests to many chats in the background.
+
+    ``publish(chat_ids, items)`` queues the items for every chat; a chat that
+    still has an unsent digest gets them merged into it, so however many
+    changes pile up, each chat receives one message. A single worker sends
+    them through ``send(chat_id, items)`` at most ``rate`` a second, which
+    leaves the rest of Telegram's global limit (enforced again by the bot's
+    rate limiter underneath) to interactive replies. Chats that blocked the
+    bot are passed to the async ``on_blocked``.
+
+    ``delay(chat_id)``, if given, says how long Telegram's flood control
+    would hold a message to that chat. Such a chat, or one whose digest was
+    refused with ``RetryAfter``, goes to the back of the queue with its
+    digest, instead of holding up the chats behind it.
+    """
+
+    def __init__(self, send, rate=10.0, on_blocked=None, delay=None):
+        self.send = send
+        self.on_blocked = on_blocked
+        self.delay = delay
+        self._bucket = TokenBucket(rate, burst=1)
+        self._queue = collections.deque()  # chat ids in arrival order
+        self._pending = {}  # chat id -> {gift id: (kind, gift)}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()  # nothing queued or being sent
+        self._idle.set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def publish(self, chat_ids, items):
+        for chat_id in chat_ids:
+            digest = self._pending.get(chat_id)
+            if digest is None:
+                digest = self._pending[chat_id] = {}
+                self._queue.append(chat_id)
+            for kind, gift in items:
+                kind = digest.get(gift["gift_id"], (kind,))[0]
+                digest[gift["gift_id"]] = kind, gift
+        if self._queue:
+            self._idle.clear()
+            self._wakeup.set()
+
+    def _requeue(self, chat_id, items):
+        # Put an unsent digest back; what came in meanwhile is newer
+        newer = self._pending.pop(chat_id, None)
+        if newer is None:
+            self._queue.append(chat_id)
+        digest = self._pending[chat_id] = {
+            gift["gift_id"]: (kind, gift) for kind, gift in items
+        }
+        for gift_id, (kind, gift) in (newer or {}).items():
+            digest[gift_id] = digest.get(gift_id, (kind,))[0], gift
+
+    def _next_chat(self):
+        """The first queued chat that can be sent to now, or None."""
+        for _ in range(len(self._queue)):
+            chat_id = self._queue.popleft()
+            if self.delay is None or self.delay(chat_id) <= 0:
+                return chat_id
+            self._queue.append(chat_id)
+        return None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self, timeout=0.0):
+        """Stop sending, after giving the queued digests ``timeout`` seconds."""
+        if self._task and timeout:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._queue:
+            logger.warning("Dropping %d unsent digests", len(self._queue))
+
+    async def run(self):
+        while True:
+            if not self._queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            chat_id = self._next_chat()
+            if chat_id is None:
+                # Every queued chat is throttled: wait until the first one
+                # clears, or a digest for another chat comes in
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), min(map(self.delay, self._queue))
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._bucket.acquire()
+            items = list(self._pending.pop(chat_id).values())
+            try:
+                await self._send(chat_id, items)
+            except Exception:
+                logger.exception("Sending a digest to chat %s failed", chat_id)
+
+    async def _send(self, chat_id, items):
+        try:
+            await self.send(chat_id, items)
+        except Forbidden:
+            logger.info("Chat %s blocked the bot, unsubscribing", chat_id)
+            if self.on_blocked:
+                await self.on_blocked(chat_id)
+        except RetryAfter as error:
+            logger.info(
+                "Digest to chat %s throttled for %ss, sending it later",
+                chat_id,
+                error.retry_after,
+            )
+            self._requeue(chat_id, items)
@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import logging
+import random
+
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1
+
+from shared import retry_busy
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    if isinstance(error, APIError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return False
+
+
+class SheetSync:
+    """Background write-behind from the local store to the spreadsheet.
+
+    Local writes land in the store's durable ``outbox`` table. This task wakes
+    up shortly after a write (or every ``interval`` seconds), collapses queued
+    edits of the same gift into its latest state and sends them all with a
+    single ``batch_update``. Rows move when someone sorts the sheet, so each
+    flush first reads the gift id column and writes every gift to the row it
+    is in now; gifts no longer in the sheet are dropped. Failed flushes are
+    retried with exponential backoff; queued changes stay in the outbox until
+    the sheet has accepted them.
+
+    With several bot processes on one outbox, ``lock()`` must return an async
+    context manager that lets only one of them flush at a time.
+    """
+
+    def __init__(
+        self,
+        store,
+        sheet_api,
+        status_col,
+        booker_col,
+        id_col,
+        interval=30.0,
+        debounce=2.0,
+        batch_size=500,
+        max_backoff=300.0,
+        lock=None,
+    ):
+        self.store = store
+        self.sheet_api = sheet_api
+        self.status_col = status_col
+        self.booker_col = booker_col
+        self.id_col = id_col
+        self.interval = interval
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.lock = lock or contextlib.nullcontext
+        self._wakeup = asyncio.Event()
+        self._task = None
+        store.add_listener(lambda event, gift: self._wakeup.set())
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            async with self.lock():
+                await self.flush()
+        except Exception:
+            logger.exception("Final sheet sync failed, changes stay queued")
+
+    async def run(self):
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                # Give closely following edits a chance to join this batch
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                async with self.lock():
+                    while await self.flush():
+                        pass
+                failures = 0
+            except Exception as error:
+                failures += 1
+                delay = min(self.max_backoff, 2**failures) * random.uniform(0.5, 1)
+                if is_retryable(error):
+                    logger.warning(
+                        "Sheet sync failed (%r), retry in %.0fs", error, delay
+                    )
+                else:
+                    logger.exception("Sheet sync failed, retry in %.0fs", delay)
+                await asyncio.sleep(delay)
+                self._wakeup.set()
+
+    async def flush(self):
+        """Push one batch of queued changes; returns how many were queued."""
+        changes = self.store.pending_changes(self.batch_size)
+        if not changes:
+            return 0
+        latest = {}
+        for change_id, gift_id, row_num, status, booker in changes:
+            # Changes queued before ids were recorded only know their row
+            latest[gift_id or row_num] = gift_id, row_num, status, booker
+
+        ids = await self.sheet_api.col_values(self.id_col)
+        rows = {gift_id: row_num for row_num, gift_id in enumerate(ids[1:], start=2)}
+        data = []
+        for gift_id, row_num, status, booker in latest.values():
+            if gift_id:
+                row_num = rows.get(gift_id)
+                if row_num is None:
+                    logger.warning(
+                        "Gift %s is no longer in the sheet, not syncing it", gift_id
+                    )
+                    continue
+            # The log cell in between is left alone, the journal keeps the history
+            data += [
+                {"range": rowcol_to_a1(row_num, col), "values": [[value]]}
+                for col, value in ((self.status_col, status), (self.booker_col, booker))
+            ]
+        if data:
+            await self.sheet_api.batch_update(data)
+        await retry_busy(self.store.ack_changes, changes[-1][0])
+        logger.info(
+            "Synced %d rows (%d changes) to the sheet", len(data) // 2, len(changes)
+        )
+        return len(changes)
@@ -0,0 +1,327 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+from collections import OrderedDict
+
+from changefeed import ChangeFeed
+from indexes import BookedIndex, GiftSearchIndex, PriceIndex
+from journal import JournalMirror
+from shared import fail_fast, retry_busy
+from snapshot import SnapshotCache
+from storage import CellHeaders, SheetsStore
+from subscriptions import AvailabilityWatch
+from sync import SheetSync
+
+logger = logging.getLogger(__name__)
+
+
+class Wishlist:
+    """One spreadsheet and everything the bot keeps for it.
+
+    The store is either the sheet itself or, with ``local_store``, a SQLite
+    file that is synced to the sheet in the background. On top of it sit the
+    snapshot cache, the indexes built from it and the change feed that
+    notices hand edits. Bookings are recorded in ``journal``, which is copied
+    to ``log_sheet`` in batches when one is given; the wishlist closes it.
+    With ``on_available(name, items)`` gifts that are freed or added are
+    reported in batches, ``available_delay`` seconds after the first one.
+
+    With ``shared`` state several bot processes serve the same wishlist:
+    bookings take a lease on the gift, only one process syncs at a time and
+    every write bumps a version that makes the others reload their snapshot.
+    """
+
+    def __init__(
+        self,
+        name,
+        sheet_api,
+        local_store=None,
+        snapshot_ttl=30.0,
+        sync_interval=30.0,
+        poll_interval=5.0,
+        poll_max_interval=120.0,
+        shared=None,
+        journal=None,
+        log_sheet=None,
+        journal_interval=60.0,
+        on_available=None,
+        available_delay=60.0,
+    ):
+        self.name = name
+        self.sheet_api = sheet_api
+        self.shared = shared
+        lease = self._gift_lease if shared else None
+        self.sheets_store = SheetsStore(sheet_api, lease=lease)
+        self.store = local_store or self.sheets_store
+        self.sheet_sync = None
+        if local_store is not None:
+            self.sheet_sync = SheetSync(
+                local_store,
+                sheet_api,
+                status_col=CellHeaders.status,
+                booker_col=CellHeaders.booker,
+                id_col=CellHeaders.gift_id,
+                interval=sync_interval,
+                lock=self._sync_lease if shared else None,
+            )
+
+        self.snapshot = SnapshotCache(
+            self.store.list_gifts,
+            ttl=snapshot_ttl,
+            stamp=self._shared_version if shared else None,
+        )
+        self.store.add_listener(lambda event, gift: self.snapshot.invalidate())
+        if shared:
+            self.store.add_listener(lambda event, gift: shared.bump(name))
+
+        # Who booked what, updated from snapshot diffs and on writes
+        self.booked_index = BookedIndex()
+        self.snapshot.add_listener(self.booked_index.refresh)
+        self.store.add_listener(self.booked_index.apply)
+        # Free gifts by words of their names, for inline queries
+        self.search_index = GiftSearchIndex()
+        self.snapshot.add_listener(self.search_index.refresh)
+        self.store.add_listener(self.search_index.apply)
+        # Free gifts by price, for /free budgets
+        self.price_index = PriceIndex()
+        self.snapshot.add_listener(self.price_index.refresh)
+        self.store.add_listener(self.price_index.apply)
+
+        self.journal = journal
+        self.journal_mirror = None
+        if journal is not None:
+            self.store.journal = functools.partial(journal.record, name)
+            if log_sheet is not None:
+                self.journal_mirror = JournalMirror(
+                    journal,
+                    name,
+                    log_sheet,
+                    interval=journal_interval,
+                    lock=self._mirror_lease if shared else None,
+                )
+
+        self.availability = None
+        if on_available is not None:
+            self.availability = AvailabilityWatch(
+                functools.partial(on_available, name),
+                delay=available_delay,
+                claim=self._claim if shared else None,
+            )
+            self.snapshot.add_listener(self.availability.refresh)
+            self.store.add_listener(self.availability.apply)
+
+        # Reloads the rows only when Drive reports the spreadsheet as modified
+        self.change_feed = None
+        if poll_interval:
+            self.change_feed = ChangeFeed(
+                sheet_api,
+                self.reload_from_sheet,
+                min_interval=poll_interval,
+                max_interval=poll_max_interval,
+            )
+        self.warm_up_task = None
+
+    def _gift_lease(self, gift_id):
+        # A booking reads, writes and reads back the row; each call may wait
+        # for quota and then run for up to the sheet's timeout. The lease is
+        # renewed before the write, but must also last until then.
+        ttl = 3 * 2 * self.sheet_api.timeout + 5
+        return self.shared.lease(f"{self.name}:gift:{gift_id}", ttl=ttl)
+
+    def _sync_lease(self):
+        # One flush can take several Sheets round-trips
+        return self.shared.lease(f"{self.name}:sync", ttl=120, timeout=120)
+
+    def _mirror_lease(self):
+        return self.shared.lease(f"{self.name}:journal", ttl=120, timeout=120)
+
+    def _claim(self, key):
+        # Long enough for every worker to have seen the change
+        return self.shared.claim(f"{self.name}:{key}", ttl=86400)
+
+    def _shared_version(self):
+        return self.shared.version(self.name)
+
+    async def reload_from_sheet(self):
+        if self.store is not self.sheets_store:
+            # Pick up gifts added or edited in the spreadsheet
+            gifts = await self.sheets_store.list_gifts()
+            await retry_busy(self.store.import_gifts, gifts)
+            if self.shared:
+                self.shared.bump(self.name)
+        self.snapshot.invalidate()
+        await self.snapshot.get()
+
+    async def warm_up(self):
+        try:
+            if self.change_feed:
+                # Remember the revision first so edits made meanwhile aren't missed
+                await self.change_feed.poll()
+            # Opens the sheet, fills the cache and builds the indexes
+            await self.reload_from_sheet()
+        except Exception:
+            logger.exception(
+                "Warm-up of %r failed, the first request will retry it", self.name
+            )
+        if self.change_feed:
+            self.change_feed.start()
+
+    def start(self):
+        if self.sheet_sync:
+            self.sheet_sync.start()
+        if self.journal_mirror:
+            self.journal_mirror.start()
+        self.warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
+
+    def touch(self):
+        if self.change_feed:
+            self.change_feed.touch()
+
+    async def stop(self):
+        if self.warm_up_task:
+            # Otherwise it could start the change feed after we stopped it
+            self.warm_up_task.cancel()
+            try:
+                await self.warm_up_task
+            except asyncio.CancelledError:
+                pass
+        if self.change_feed:
+            await self.change_feed.stop()
+        if self.sheet_sync:
+            await self.sheet_sync.stop()
+        if self.availability:
+            self.availability.flush()
+        if self.journal_mirror:
+            await self.journal_mirror.stop()
+            self.journal_mirror.log_sheet.shutdown()
+        if self.journal:
+            self.journal.close()
+        if self.store is not self.sheets_store:
+            self.store.close()
+        self.sheet_api.shutdown()
+
+
+class WishlistRegistry:
+    """Which wishlist (spreadsheet name) each chat uses.
+
+    Assignments live in a small SQLite table and are read once per chat
+    (on every lookup with ``cache=False``, when other processes may change
+    them); chats without one use ``default``. ``assign`` gives up at once
+    while another process holds the database; callers retry it with
+    ``retry_busy``.
+    """
+
+    TABLE = """
+        CREATE TABLE IF NOT EXISTS chat_wishlists (
+            chat_id INTEGER PRIMARY KEY,
+            wishlist TEXT NOT NULL
+        )
+    """
+
+    def __init__(self, path, default, cache=True):
+        self.default = default
+        self.cache = cache
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.TABLE)
+        fail_fast(self.conn)
+        self._names = {}  # chat id -> wishlist name
+
+    def name_for(self, chat_id):
+        if chat_id not in self._names or not self.cache:
+            record = self.conn.execute(
+                "SELECT wishlist FROM chat_wishlists WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            self._names[chat_id] = record[0] if record else self.default
+        return self._names[chat_id]
+
+    def assign(self, chat_id, name):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO chat_wishlists (chat_id, wishlist) VALUES (?, ?)",
+            (chat_id, name),
+        )
+        self._names[chat_id] = name
+
+    def close(self):
+        self.conn.close()
+
+
+class WishlistPool:
+    """Open wishlists, with the least recently used closed first.
+
+    ``factory(name)`` builds a wishlist the first time it is needed; at most
+    ``max_size`` stay open. An evicted wishlist is stopped ``grace`` seconds
+    later, so handlers still holding it can finish; stopping flushes its
+    pending sync. Used again within the grace period, it is taken back
+    instead of opening a second copy next to it; after that it is rebuilt.
+    Names in ``pinned`` are never evicted.
+    """
+
+    def __init__(self, factory, max_size=16, pinned=(), grace=30.0):
+        self.factory = factory
+        self.max_size = max_size
+        self.pinned = set(pinned)
+        self.grace = grace
+        self._open = OrderedDict()
+        self._retiring = {}  # name -> (task, evicted wishlist) in their grace
+        self._tasks = set()  # retire tasks, including those already stopping
+
+    def __len__(self):
+        return len(self._open)
+
+    def __contains__(self, name):
+        return name in self._open or name in self._retiring
+
+    def get(self, name):
+        wishlist = self._open.get(name)
+        if wishlist is not None:
+            self._open.move_to_end(name)
+            return wishlist
+        if name in self._retiring:
+            # Handlers may still be using it; a second copy would have its
+            # own row locks and sync task on the same sheet
+            task, wishlist = self._retiring.pop(name)
+            task.cancel()
+            self._open[name] = wishlist
+        else:
+            wishlist = self._open[name] = self.factory(name)
+            wishlist.start()
+        self._evict()
+        return wishlist
+
+    async def discard(self, name):
+        """Close ``name`` right away, e.g. after it failed to open."""
+        wishlist = self._open.pop(name, None)
+        if wishlist is not None:
+            await wishlist.stop()
+
+    def _evict(self):
+        for name in list(self._open):
+            if len(self._open) <= self.max_size:
+                break
+            if name in self.pinned:
+                continue
+            wishlist = self._open.pop(name)
+            logger.info("Closing idle wishlist %r", name)
+            task = asyncio.get_running_loop().create_task(self._retire(name, wishlist))
+            self._retiring[name] = task, wishlist
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _retire(self, name, wishlist):
+        await asyncio.sleep(self.grace)
+        # From here on get() opens a new copy instead
+        del self._retiring[name]
+        await wishlist.stop()
+
+    async def close(self):
+        wishlists = list(self._open.values())
+        for task, wishlist in self._retiring.values():
+            task.cancel()
+            wishlists.append(wishlist)
+        self._retiring.clear()
+        self._open.clear()
+        await asyncio.gather(*(wishlist.stop() for wishlist in wishlists))
+        # Wishlists that were already stopping
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,17 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    """The bot module, with its databases in a temporary directory."""
+    workdir = tmp_path_factory.mktemp("bot")
+    os.environ["SQLITE_PATH"] = str(workdir / "bot.db")
+    os.environ["METRICS_PORT"] = "0"
+    return importlib.import_module("bot")
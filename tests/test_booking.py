@@ -0,0 +1,112 @@
+"""Concurrent bookings of one gift against an in-memory sheet."""
+
+import asyncio
+import functools
+
+from benchmarks.fakes import FakeWorksheet
+from journal import BookingJournal
+from shared import SharedState
+from sheets import AsyncSheet
+from storage import CellHeaders, SheetsStore
+
+USERS = 300
+
+
+def make_store(worksheet, journal, lease=None):
+    store = SheetsStore(AsyncSheet(worksheet=worksheet), lease=lease)
+    store.journal = functools.partial(journal.record, "test")
+    return store
+
+
+async def book_all(stores, gift_id):
+    """Every user confirms ``gift_id`` at once, spread over ``stores``."""
+    for store in stores:
+        await store.list_gifts()
+    results = await asyncio.gather(
+        *(
+            stores[user_id % len(stores)].book(gift_id, user_id, f"User {user_id}")
+            for user_id in range(USERS)
+        )
+    )
+    return [user_id for user_id, (booked, gift) in enumerate(results) if booked]
+
+
+def assert_single_winner(winners, worksheet, journal, gift_id):
+    assert len(winners) == 1
+    winner = winners[0]
+    row = worksheet.rows[1]
+    assert row[CellHeaders.gift_id - 1] == gift_id
+    assert row[CellHeaders.status - 1] == f"User {winner}"
+    assert row[CellHeaders.booker - 1] == str(winner)
+    events = journal.history("test", gift_id)
+    assert [(e["action"], e["user_id"]) for e in events] == [("book", str(winner))]
+
+
+def test_one_winner_among_concurrent_confirms():
+    worksheet = FakeWorksheet(gifts=3, latency=0.001, ids=True)
+    journal = BookingJournal(":memory:")
+    store = make_store(worksheet, journal)
+
+    winners = asyncio.run(book_all([store], "gift0001"))
+
+    assert_single_winner(winners, worksheet, journal, "gift0001")
+    # The other gifts were not touched
+    assert all(not row[CellHeaders.status - 1] for row in worksheet.rows[2:])
+
+
+def test_one_winner_across_processes(tmp_path):
+    # Separate stores have separate row locks, like separate bot processes;
+    # only the shared lease keeps them apart
+    worksheet = FakeWorksheet(gifts=3, latency=0.001, ids=True)
+    journal = BookingJournal(str(tmp_path / "journal.db"))
+    shared = SharedState(str(tmp_path / "shared.db"))
+
+    def lease(gift_id):
+        return shared.lease(f"test:gift:{gift_id}")
+
+    stores = [make_store(worksheet, journal, lease=lease) for _ in range(4)]
+
+    winners = asyncio.run(book_all(stores, "gift0001"))
+
+    assert_single_winner(winners, worksheet, journal, "gift0001")
+    shared.close()
+    journal.close()
+
+
+def test_released_gift_goes_to_one_new_winner():
+    worksheet = FakeWorksheet(gifts=1, latency=0.001, ids=True)
+    journal = BookingJournal(":memory:")
+    store = make_store(worksheet, journal)
+
+    async def scenario():
+        await store.list_gifts()
+        assert (await store.book("gift0001", 9999, "Owner"))[0]
+        assert (await store.unbook("gift0001", 9999, "Owner"))[0]
+        return await book_all([store], "gift0001")
+
+    winners = asyncio.run(scenario())
+
+    assert len(winners) == 1
+    events = journal.history("test", "gift0001")
+    assert [e["action"] for e in events] == ["book", "unbook", "book"]
+    assert events[-1]["user_id"] == str(winners[0])
+
+
+def test_unknown_gift_is_answered_from_the_row_map():
+    worksheet = FakeWorksheet(gifts=3, ids=True)
+    store = SheetsStore(AsyncSheet(worksheet=worksheet))
+
+    async def main():
+        await store.list_gifts()
+        worksheet.calls.clear()
+        missing = await store.book("nosuchid", 1, "Ann")
+        # Sorting the sheet moves the gift; the stale row triggers one re-list
+        worksheet.rows[1:] = worksheet.rows[:0:-1]
+        moved = await store.book("gift0001", 1, "Ann")
+        return missing, moved
+
+    missing, (booked, gift) = asyncio.run(main())
+
+    assert missing == (False, None)
+    assert booked and gift["row"] == 4
+    assert worksheet.calls["get_all_values"] == 1
@@ -0,0 +1,86 @@
+"""Polling the spreadsheet's modification time with ChangeFeed."""
+
+import asyncio
+
+from changefeed import ChangeFeed
+
+
+class FakeSheet:
+    def __init__(self):
+        self.modified = "2026-01-01T00:00:00"
+        self.polls = 0
+        self.error = None
+
+    async def last_update_time(self):
+        self.polls += 1
+        if self.error:
+            raise self.error
+        return self.modified
+
+
+def make_feed(sheet, reloads, **intervals):
+    async def on_change():
+        reloads.append(sheet.modified)
+
+    return ChangeFeed(sheet, on_change, **intervals)
+
+
+def test_first_poll_only_remembers_the_time():
+    sheet, reloads = FakeSheet(), []
+    feed = make_feed(sheet, reloads)
+
+    async def main():
+        first = await feed.poll()
+        unchanged = await feed.poll()
+        sheet.modified = "2026-01-01T00:05:00"
+        changed = await feed.poll()
+        return first, unchanged, changed
+
+    assert asyncio.run(main()) == (False, False, True)
+    assert reloads == ["2026-01-01T00:05:00"]
+
+
+async def wait_for_interval(feed, interval):
+    while feed.interval != interval:
+        await asyncio.sleep(0.001)
+
+
+def test_idle_feed_backs_off_and_activity_resets_it():
+    sheet, reloads = FakeSheet(), []
+    feed = make_feed(
+        sheet, reloads, min_interval=0.001, max_interval=0.008, idle_after=0.0
+    )
+
+    async def main():
+        feed.start()
+        try:
+            await asyncio.wait_for(wait_for_interval(feed, 0.008), 1)
+            polls = sheet.polls
+            feed.touch()
+            assert feed.interval == 0.001
+            # The sleeping loop is woken up instead of finishing its long wait
+            await asyncio.wait_for(wait_for_interval(feed, 0.002), 1)
+            assert sheet.polls > polls
+        finally:
+            await feed.stop()
+
+    asyncio.run(main())
+    assert reloads == []
+
+
+def test_failed_polls_back_off_while_active():
+    sheet, reloads = FakeSheet(), []
+    sheet.error = ConnectionError("offline")
+    feed = make_feed(sheet, reloads, min_interval=0.001, max_interval=0.004)
+
+    async def main():
+        feed.start()
+        try:
+            await asyncio.wait_for(wait_for_interval(feed, 0.004), 1)
+            sheet.error = None
+            await asyncio.wait_for(wait_for_interval(feed, 0.001), 1)
+        finally:
+            await feed.stop()
+
+    asyncio.run(main())
+    assert reloads == []
@@ -0,0 +1,122 @@
+"""Indexes kept current from snapshot diffs and store writes."""
+
+from indexes import GiftSearchIndex, PriceIndex, parse_price
+
+
+def gift(number, name, price="", status=""):
+    return {
+        "row": number + 1,
+        "gift_name": name,
+        "price": price,
+        "link": f"https://example.com/{number}",
+        "status": status,
+        "log": "",
+        "booker": "1" if status else "",
+        "gift_id": f"gift{number:04d}",
+    }
+
+
+def names(gifts):
+    return [gift["gift_name"] for gift in gifts]
+
+
+def search_index(*gifts):
+    index = GiftSearchIndex()
+    index.refresh(list(gifts), list(gifts), [])
+    return index
+
+
+def test_search_matches_word_prefixes():
+    index = search_index(
+        gift(1, "Настільна гра Каркасон"),
+        gift(2, "Гарнітура Sony"),
+        gift(3, "Книга «Гра престолів»"),
+    )
+
+    assert names(index.search("гр")) == [
+        "Настільна гра Каркасон",
+        "Книга «Гра престолів»",
+    ]
+    assert names(index.search("SON")) == ["Гарнітура Sony"]
+    # Only beginnings of words count
+    assert index.search("ркас") == []
+    # An empty query lists every free gift
+    assert len(index.search("")) == 3
+
+
+def test_every_word_of_the_query_must_match():
+    index = search_index(
+        gift(1, "Настільна гра Каркасон"),
+        gift(2, "Настільна лампа"),
+        gift(3, "Гра престолів"),
+    )
+
+    assert names(index.search("наст гра")) == ["Настільна гра Каркасон"]
+    assert names(index.search("гра наст")) == ["Настільна гра Каркасон"]
+    assert index.search("лампа гра") == []
+
+
+def test_booked_gifts_drop_out_and_come_back():
+    lamp, game = gift(1, "Лампа"), gift(2, "Лава для саду")
+    index = search_index(lamp, game)
+
+    index.apply("book", {**lamp, "status": "Ann", "booker": "1"})
+    assert names(index.search("ла")) == ["Лава для саду"]
+
+    index.apply("unbook", lamp)
+    assert names(index.search("ла")) == ["Лампа", "Лава для саду"]
+
+    # A renamed gift is found by its new name only
+    renamed = {**game, "gift_name": "Гамак"}
+    index.refresh([lamp, renamed], [renamed], [])
+    assert names(index.search("лав")) == []
+    assert names(index.search("гам")) == ["Гамак"]
+    # Gifts removed from the sheet are gone, and so are their prefixes
+    index.refresh([renamed], [], [lamp["gift_id"]])
+    assert index.search("ла") == []
+
+
+def test_prices_are_read_with_their_separators():
+    assert parse_price("1 200 грн") == 1200
+    assert parse_price("1,200 грн") == 1200
+    assert parse_price("1,200,000") == 1200000
+    assert parse_price("1,200.50 $") == 1200.5
+    assert parse_price("99,90") == 99.9
+    assert parse_price("~ 350") == 350
+    assert parse_price("договірна") is None
+
+
+def price_index(*gifts):
+    index = PriceIndex()
+    index.refresh(list(gifts), list(gifts), [])
+    return index
+
+
+def test_price_index_selects_free_gifts_in_a_budget():
+    index = price_index(
+        gift(1, "Лампа", "1,200 грн"),
+        gift(2, "Книга", "350"),
+        gift(3, "Чашка", "150 грн"),
+        gift(4, "Сюрприз", "?"),
+        gift(5, "Плед", "800", status="Ann"),
+    )
+
+    assert names(index.select(high=500)) == ["Чашка", "Книга"]
+    assert names(index.select(low=350, high=1200)) == ["Книга", "Лампа"]
+    assert names(index.select(low=300, descending=True)) == ["Лампа", "Книга"]
+    # Without a range everything free is listed, unreadable prices last
+    assert names(index.select()) == ["Чашка", "Книга", "Лампа", "Сюрприз"]
+
+
+def test_price_index_follows_bookings_and_price_changes():
+    cup, book = gift(1, "Чашка", "150"), gift(2, "Книга", "350")
+    index = price_index(cup, book)
+
+    index.apply("book", {**cup, "status": "Ann", "booker": "1"})
+    assert names(index.select(high=500)) == ["Книга"]
+    index.apply("unbook", cup)
+
+    dearer = {**cup, "price": "600"}
+    index.refresh([dearer, book], [dearer], [])
+    assert names(index.select(high=500)) == ["Книга"]
+    assert names(index.select(descending=True)) == ["Чашка", "Книга"]
@@ -0,0 +1,103 @@
+"""/free budgets, and paging through /free and /my_booked."""
+
+import asyncio
+from types import SimpleNamespace
+
+
+def gifts(count, **fields):
+    return [
+        {
+            "row": number + 1,
+            "gift_name": f"Gift {number}",
+            "price": "",
+            "link": f"https://example.com/{number}",
+            "status": "",
+            "log": "",
+            "booker": "",
+            "gift_id": f"gift{number:04d}",
+            **fields,
+        }
+        for number in range(1, count + 1)
+    ]
+
+
+def page_buttons(reply_markup):
+    return [
+        button.callback_data
+        for row in reply_markup.inline_keyboard
+        for button in row
+        if button.callback_data and button.callback_data.startswith("page|")
+    ]
+
+
+class FakeQuery:
+    def __init__(self, data, user_id):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, full_name=f"User {user_id}")
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.edits.append((text, reply_markup))
+
+
+def press(bot, data, user_id):
+    query = FakeQuery(data, user_id)
+    update = SimpleNamespace(callback_query=query)
+    asyncio.run(bot.change_page(update, None))
+    return query
+
+
+def test_budget_arguments(bot):
+    assert bot.parse_budget([]) is None
+    assert bot.parse_budget(["до", "500"]) == (None, 500, False)
+    assert bot.parse_budget(["500"]) == (None, 500, False)
+    assert bot.parse_budget(["від", "1,200", "грн"]) == (1200, None, False)
+    assert bot.parse_budget(["800-300"]) == (300, 800, False)
+    assert bot.parse_budget(["1", "000", "–", "2", "500"]) == (1000, 2500, False)
+    assert bot.parse_budget(["до", "99,90"]) == (None, 99.9, False)
+    assert bot.parse_budget(["дорожчі"]) == (None, None, True)
+    assert bot.parse_budget(["дешевші", "до", "300"]) == (None, 300, False)
+
+
+def test_booked_pages_carry_their_owner(bot):
+    booked = gifts(bot.PAGE_SIZE + 1, status="Ann", booker="7")
+
+    text, markup = bot.render_page("booked", booked, 0, owner=7)
+
+    assert page_buttons(markup) == ["page|booked|1|7"]
+
+
+def test_others_cannot_page_through_a_booked_list(bot, monkeypatch):
+    listed = []
+
+    async def list_gifts(wishlist, kind, user, budget=None):
+        listed.append(user.id)
+        return gifts(bot.PAGE_SIZE + 1, status="Ann", booker=str(user.id))
+
+    monkeypatch.setattr(bot, "list_gifts", list_gifts)
+    monkeypatch.setattr(bot, "wishlist_for", lambda update: None)
+
+    stranger = press(bot, "page|booked|1|7", 8)
+    owner = press(bot, "page|booked|1|7", 7)
+
+    assert stranger.edits == [] and stranger.answers[0].startswith("🙈")
+    assert listed == [7]
+    text, markup = owner.edits[0]
+    assert page_buttons(markup) == ["page|booked|0|7"]
+
+
+def test_free_pages_keep_the_budget(bot, monkeypatch):
+    async def list_gifts(wishlist, kind, user, budget=None):
+        assert budget == (None, 500.0, False)
+        return gifts(2 * bot.PAGE_SIZE)
+
+    monkeypatch.setattr(bot, "list_gifts", list_gifts)
+    monkeypatch.setattr(bot, "wishlist_for", lambda update: None)
+
+    query = press(bot, "page|free|1||500|a", 8)
+
+    assert page_buttons(query.edits[0][1]) == ["page|free|0||500|a"]
@@ -0,0 +1,87 @@
+"""User and chat data kept in SQLite by SQLitePersistence."""
+
+import asyncio
+
+from persistence import SQLitePersistence
+
+
+def stored(persistence, kind="user"):
+    return dict(
+        persistence.conn.execute(
+            "SELECT key, version FROM persistence WHERE kind = ?", (kind,)
+        ).fetchall()
+    )
+
+
+def test_entries_are_loaded_lazily_and_merged(tmp_path):
+    path = tmp_path / "state.db"
+
+    async def main():
+        first = SQLitePersistence(path)
+        await first.update_user_data(1, {"page": 2, "budget": 500})
+        await asyncio.sleep(0)
+        await first.flush()
+
+        second = SQLitePersistence(path)
+        assert await second.get_user_data() == {}
+        # Set by a handler before the entry was loaded, so it wins
+        data = {"page": 5}
+        await second.refresh_user_data(1, data)
+        assert data == {"page": 5, "budget": 500}
+
+        # Loaded once; without shared the file isn't read again
+        second.conn.execute("DELETE FROM persistence")
+        await second.refresh_user_data(1, data)
+        assert data == {"page": 5, "budget": 500}
+
+    asyncio.run(main())
+
+
+def test_updates_in_one_tick_share_a_transaction(tmp_path):
+    persistence = SQLitePersistence(tmp_path / "state.db")
+    statements = []
+    persistence.conn.set_trace_callback(statements.append)
+
+    async def main():
+        for user_id in range(1, 6):
+            await persistence.update_user_data(user_id, {"page": user_id})
+        await persistence.drop_user_data(3)
+        assert statements == []  # nothing written until the batch is complete
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+    assert statements.count("BEGIN IMMEDIATE") == 1
+    assert stored(persistence) == {1: 0, 2: 0, 4: 0, 5: 0}
+
+
+def test_shared_entries_are_reloaded_after_other_writes(tmp_path):
+    path = tmp_path / "state.db"
+
+    async def main():
+        one = SQLitePersistence(path, shared=True)
+        two = SQLitePersistence(path, shared=True)
+        await one.update_chat_data(10, {"wishlist": "home"})
+        await asyncio.sleep(0)
+
+        seen = {}
+        await two.refresh_chat_data(10, seen)
+        assert seen == {"wishlist": "home"}
+
+        await one.update_chat_data(10, {"wishlist": "work"})
+        await asyncio.sleep(0)
+        assert stored(one, "chat") == {10: 1}
+        await two.refresh_chat_data(10, seen)
+        assert seen == {"wishlist": "work"}
+
+        # The same version isn't read again, and a write of our own that is
+        # still queued is newer than the stored one
+        seen["page"] = 1
+        await two.refresh_chat_data(10, seen)
+        await two.update_chat_data(10, {"wishlist": "mine"})
+        mine = {"wishlist": "mine"}
+        await two.refresh_chat_data(10, mine)
+        assert seen == {"wishlist": "work", "page": 1}
+        assert mine == {"wishlist": "mine"}
+
+    asyncio.run(main())
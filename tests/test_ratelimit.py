@@ -0,0 +1,163 @@
+"""FloodControlLimiter against a fake Bot that answers with errors."""
+
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from ratelimit import FloodControlLimiter
+
+
+class FakeBot:
+    """Sends messages, failing with the queued errors first.
+
+    ``errors`` maps a chat id to the exceptions its next calls raise, in order.
+    """
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []  # (chat id, monotonic time)
+
+    async def send_message(self, chat_id):
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, time.monotonic()))
+        return chat_id
+
+
+def limiter(**kwargs):
+    # Generous buckets, so only the errors make anyone wait
+    kwargs.setdefault("overall_rate", 1000)
+    kwargs.setdefault("chat_rate", 1000)
+    kwargs.setdefault("chat_burst", 1000)
+    return FloodControlLimiter(**kwargs)
+
+
+def send(limiter, bot, chat_id):
+    return limiter.process_request(
+        bot.send_message,
+        (),
+        {"chat_id": chat_id},
+        "sendMessage",
+        {"chat_id": chat_id},
+        None,
+    )
+
+
+def test_retry_after_pauses_only_that_chat():
+    bot = FakeBot({1: [RetryAfter(0.3)]})
+    flood = limiter()
+
+    async def scenario():
+        started = time.monotonic()
+        first = asyncio.ensure_future(send(flood, bot, 1))
+        await asyncio.sleep(0.05)
+        # Chat 1 is paused now, chat 2 is not
+        assert flood.stats()["depth"] == 1
+        assert await send(flood, bot, 2) == 2
+        assert await first == 1
+        return started
+
+    started = asyncio.run(scenario())
+
+    sent = dict(bot.sent)
+    assert sent[2] - started < 0.2
+    assert sent[1] - started >= 0.3
+    stats = flood.stats()
+    assert stats["retry_after"] == 1
+    assert stats["requests"] == 2
+    assert stats["depth"] == 0
+    assert stats["max_depth"] >= 1
+    assert stats["wait_seconds_max"] >= 0.3
+    assert stats["wait_seconds_total"] >= stats["wait_seconds_max"]
+
+
+def test_retry_after_gives_up_after_max_retries():
+    bot = FakeBot({1: [RetryAfter(0.01) for _ in range(4)]})
+    flood = limiter(max_retries=2)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(send(flood, bot, 1))
+
+    # The first try and two retries
+    assert len(bot.errors[1]) == 1
+    assert bot.sent == []
+    assert flood.stats()["retry_after"] == 3
+
+
+def test_network_errors_are_retried(monkeypatch):
+    bot = FakeBot({1: [TimedOut(), TimedOut()]})
+    flood = limiter(network_retries=2)
+    delays = []
+    sleep = asyncio.sleep
+
+    async def no_backoff(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", no_backoff)
+
+    assert asyncio.run(send(flood, bot, 1)) == 1
+    assert flood.stats()["network_retries"] == 2
+    assert delays == [1.0, 2.0]
+
+
+def test_network_errors_give_up_after_network_retries(monkeypatch):
+    bot = FakeBot({1: [TimedOut(), TimedOut()]})
+    flood = limiter(network_retries=1)
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: sleep(0))
+
+    with pytest.raises(TimedOut):
+        asyncio.run(send(flood, bot, 1))
+    assert flood.stats()["network_retries"] == 1
+
+
+def test_bad_request_is_not_retried():
+    bot = FakeBot({1: [BadRequest("Message is not modified"), None]})
+    flood = limiter()
+
+    with pytest.raises(BadRequest):
+        asyncio.run(send(flood, bot, 1))
+
+    assert bot.errors[1] == [None]
+    assert flood.stats()["network_retries"] == 0
+
+
+def test_chat_bucket_spaces_out_messages():
+    bot = FakeBot()
+    flood = limiter(chat_rate=20, chat_burst=1)
+
+    async def scenario():
+        await asyncio.gather(*(send(flood, bot, 1) for _ in range(5)))
+
+    asyncio.run(scenario())
+
+    times = [at for chat_id, at in bot.sent]
+    assert times[-1] - times[0] >= 4 / 20 * 0.9
+    assert flood.stats()["wait_seconds_max"] > 0.15
+
+
+def test_a_refused_request_still_pauses_its_chat():
+    bot = FakeBot({1: [RetryAfter(0.3)]})
+    flood = limiter()
+
+    async def scenario():
+        # No retries: the caller gets RetryAfter and decides when to try again
+        with pytest.raises(RetryAfter):
+            await flood.process_request(
+                bot.send_message,
+                (),
+                {"chat_id": 1},
+                "sendMessage",
+                {"chat_id": 1},
+                0,
+            )
+        assert 0.2 < flood.chat_delay(1) <= 0.4
+        assert flood.chat_delay(2) == 0
+        await asyncio.sleep(0.45)
+        assert flood.chat_delay(1) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,223 @@
+"""Several workers on one SharedState and one SQLite store."""
+
+import asyncio
+import contextlib
+import functools
+import sqlite3
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeWorksheet
+from journal import BookingJournal
+from persistence import SQLitePersistence
+from shared import LeaseLost, SharedState
+from sheets import AsyncSheet
+from storage import SheetsStore, SQLiteStore
+from tenants import Wishlist
+
+
+def worker(tmp_path, shared, worksheet):
+    return Wishlist(
+        "test",
+        AsyncSheet(worksheet=worksheet),
+        local_store=SQLiteStore(str(tmp_path / "wishlist.db")),
+        snapshot_ttl=300,
+        poll_interval=0,
+        shared=shared,
+    )
+
+
+def test_my_booked_sees_other_workers_bookings(tmp_path, bot):
+    worksheet = FakeWorksheet(gifts=3, ids=True)
+    shared_a = SharedState(str(tmp_path / "shared.db"))
+    shared_b = SharedState(str(tmp_path / "shared.db"))
+    user = SimpleNamespace(id=1, full_name="Alice")
+
+    async def scenario():
+        a = worker(tmp_path, shared_a, worksheet)
+        b = worker(tmp_path, shared_b, worksheet)
+        await a.reload_from_sheet()
+        await b.reload_from_sheet()
+        assert await bot.list_gifts(a, "booked", user) == []
+        assert (await b.store.book("gift0001", 1, "Alice"))[0]
+        booked = await bot.list_gifts(a, "booked", user)
+        for wishlist in (a, b):
+            wishlist.store.close()
+        return booked
+
+    booked = asyncio.run(scenario())
+
+    assert [gift["gift_id"] for gift in booked] == ["gift0001"]
+    shared_a.close()
+    shared_b.close()
+
+
+def test_my_booked_after_a_booking_skips_the_sheet(bot):
+    worksheet = FakeWorksheet(gifts=3, ids=True)
+    wishlist = Wishlist(
+        "test", AsyncSheet(worksheet=worksheet), snapshot_ttl=300, poll_interval=0
+    )
+    user = SimpleNamespace(id=1, full_name="Alice")
+
+    async def scenario():
+        assert await bot.list_gifts(wishlist, "booked", user) == []
+        assert (await wishlist.store.book("gift0002", 1, "Alice"))[0]
+        return await bot.list_gifts(wishlist, "booked", user)
+
+    booked = asyncio.run(scenario())
+
+    assert [gift["gift_id"] for gift in booked] == ["gift0002"]
+    # The booking invalidated the snapshot, but the index already has it
+    assert worksheet.calls["get_all_values"] == 1
+
+
+def hold_write_lock(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+
+def test_busy_store_does_not_block_the_loop(tmp_path):
+    path = str(tmp_path / "wishlist.db")
+    worksheet = FakeWorksheet(gifts=1, ids=True)
+    store = SQLiteStore(path)
+
+    async def scenario():
+        store.import_gifts(await SheetsStore(AsyncSheet(worksheet)).list_gifts())
+        other = hold_write_lock(path)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.3, other.execute, "COMMIT")
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.ensure_future(ticker())
+        started = time.monotonic()
+        booked, gift = await store.book("gift0001", 1, "Alice")
+        ticking.cancel()
+        other.close()
+        return booked, time.monotonic() - started, ticks
+
+    booked, took, ticks = asyncio.run(scenario())
+
+    assert booked
+    assert took >= 0.3
+    # The loop kept running while the booking waited for the lock
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+    store.close()
+
+
+def test_lease_waits_for_a_busy_database(tmp_path):
+    path = str(tmp_path / "shared.db")
+    shared = SharedState(path)
+
+    async def scenario():
+        other = hold_write_lock(path)
+        asyncio.get_running_loop().call_later(0.2, other.execute, "COMMIT")
+        started = time.monotonic()
+        async with shared.lease("key"):
+            waited = time.monotonic() - started
+        other.close()
+        return waited
+
+    assert asyncio.run(scenario()) >= 0.2
+    # Released again despite the busy start
+    assert shared.claim("key", ttl=1)
+    shared.close()
+
+
+def test_expired_lease_is_renewed_until_someone_takes_it(tmp_path):
+    path = str(tmp_path / "shared.db")
+    shared_a, shared_b = SharedState(path), SharedState(path)
+
+    async def scenario():
+        async with shared_a.lease("key", ttl=0.01) as renew:
+            await asyncio.sleep(0.02)
+            # Expired, but nobody else has it: still safe to write
+            await renew()
+            assert not shared_b.claim("key", ttl=1)
+            await asyncio.sleep(0.02)
+            assert shared_b.claim("key", ttl=1)
+            try:
+                await renew()
+            except LeaseLost:
+                return True
+        return False
+
+    assert asyncio.run(scenario())
+    # Releasing a lost lease leaves the new holder's alone
+    assert not shared_a.claim("key", ttl=1)
+    shared_a.close()
+    shared_b.close()
+
+
+def test_booking_is_not_written_after_losing_the_lease():
+    worksheet = FakeWorksheet(gifts=3, ids=True)
+
+    @contextlib.asynccontextmanager
+    async def lost_lease(gift_id):
+        async def renew():
+            raise LeaseLost(gift_id)
+
+        yield renew
+
+    store = SheetsStore(AsyncSheet(worksheet=worksheet), lease=lost_lease)
+
+    async def scenario():
+        await store.list_gifts()
+        try:
+            await store.book("gift0001", 1, "Alice")
+        except LeaseLost:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+    assert worksheet.calls["batch_update"] == 0
+
+
+def test_journal_of_a_sheets_booking_waits_for_a_busy_database(tmp_path):
+    path = str(tmp_path / "journal.db")
+    worksheet = FakeWorksheet(gifts=1, ids=True)
+    journal = BookingJournal(path)
+    store = SheetsStore(AsyncSheet(worksheet=worksheet))
+    store.journal = functools.partial(journal.record, "test")
+
+    async def scenario():
+        await store.list_gifts()
+        other = hold_write_lock(path)
+        asyncio.get_running_loop().call_later(0.2, other.execute, "COMMIT")
+        # The commit above can only run if the loop isn't blocked meanwhile
+        booked, gift = await store.book("gift0001", 1, "Alice")
+        other.close()
+        return booked
+
+    assert asyncio.run(scenario())
+    assert [event["action"] for event in journal.history("test", "gift0001")] == [
+        "book"
+    ]
+    journal.close()
+
+
+def test_persistence_retries_a_busy_batch(tmp_path):
+    path = str(tmp_path / "state.db")
+    persistence = SQLitePersistence(path, shared=True)
+
+    async def scenario():
+        other = hold_write_lock(path)
+        await persistence.update_user_data(1, {"page": 1})
+        await asyncio.sleep(0.1)
+        assert persistence._pending  # still queued, the loop wasn't blocked
+        other.execute("COMMIT")
+        other.close()
+        await asyncio.sleep(0.2)
+        assert not persistence._pending
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    reopened = SQLitePersistence(path)
+    data = {}
+    asyncio.run(reopened.refresh_user_data(1, data))
+    assert data == {"page": 1}
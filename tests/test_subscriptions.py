@@ -0,0 +1,142 @@
+"""Digests of freed and new gifts: AvailabilityWatch and Broadcaster."""
+
+import asyncio
+
+from telegram.error import RetryAfter
+
+from subscriptions import AvailabilityWatch, Broadcaster
+
+
+def gift(number, status=""):
+    return {
+        "row": number + 1,
+        "gift_name": f"Gift {number}",
+        "price": "",
+        "link": f"https://example.com/{number}",
+        "status": status,
+        "log": "",
+        "booker": "1" if status else "",
+        "gift_id": f"gift{number:04d}",
+    }
+
+
+def reported(batches):
+    return [[(kind, gift["gift_id"]) for kind, gift in items] for items in batches]
+
+
+def test_changes_within_the_window_are_reported_together():
+    batches = []
+    watch = AvailabilityWatch(batches.append, delay=0.05)
+    first = [gift(1, "Ann"), gift(2, "Bob"), gift(3)]
+
+    async def main():
+        watch.refresh(first, first, [])  # the first snapshot reports nothing
+        watch.apply("unbook", gift(1))
+        added = [*first, gift(4)]
+        watch.refresh(added, [gift(4)], [])
+        # Freed and booked again within the window: no news
+        watch.apply("unbook", gift(2))
+        watch.apply("book", gift(2, "Cid"))
+        assert batches == []
+        await asyncio.sleep(0.1)
+        # The next change opens a new window
+        watch.apply("unbook", gift(4))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert reported(batches) == [
+        [("freed", "gift0001"), ("added", "gift0004")],
+        [("freed", "gift0004")],
+    ]
+
+
+def test_shared_watch_reports_claimed_additions_only():
+    batches, claims = [], []
+
+    def claim(key):
+        claims.append(key)
+        return key != "added:gift0003"
+
+    watch = AvailabilityWatch(batches.append, delay=0.01, claim=claim)
+
+    async def main():
+        first = [gift(1, "Ann")]
+        watch.refresh(first, first, [])
+        # Freed by hand, or by another worker that has reported it already
+        rows = [gift(1), gift(2), gift(3)]
+        watch.refresh(rows, rows, [])
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+
+    assert claims == ["added:gift0002", "added:gift0003"]
+    assert reported(batches) == [[("added", "gift0002")]]
+
+
+class Recorder:
+    """``send`` for a Broadcaster, failing once for chats in ``failures``.
+
+    Like the bot's rate limiter, it remembers in ``throttled`` how long a
+    chat is paused after ``RetryAfter``.
+    """
+
+    def __init__(self, failures=None):
+        self.sent = []
+        self.failures = failures or {}
+        self.throttled = {}
+
+    def delay(self, chat_id):
+        return self.throttled.get(chat_id, 0.0)
+
+    async def __call__(self, chat_id, items):
+        failure = self.failures.pop(chat_id, None)
+        if isinstance(failure, RetryAfter):
+            self.throttled[chat_id] = failure.retry_after
+        if failure is not None:
+            raise failure
+        self.sent.append((chat_id, [(kind, gift["gift_id"]) for kind, gift in items]))
+
+
+def test_digests_are_merged_per_chat():
+    send = Recorder()
+    broadcaster = Broadcaster(send, rate=1000)
+
+    async def main():
+        broadcaster.publish([1, 2], [("freed", gift(1))])
+        broadcaster.publish([2, 3], [("added", gift(2)), ("freed", gift(1))])
+        # Added and then freed is still news as "added"
+        broadcaster.publish([3], [("freed", gift(2))])
+        assert len(broadcaster) == 3
+        broadcaster.start()
+        await broadcaster.stop(timeout=1)
+
+    asyncio.run(main())
+
+    assert send.sent == [
+        (1, [("freed", "gift0001")]),
+        (2, [("freed", "gift0001"), ("added", "gift0002")]),
+        (3, [("added", "gift0002"), ("freed", "gift0001")]),
+    ]
+
+
+def test_throttled_chats_wait_at_the_back():
+    send = Recorder(failures={2: RetryAfter(1), 4: RuntimeError("boom")})
+    send.throttled[1] = 0.05
+    broadcaster = Broadcaster(send, rate=1000, delay=send.delay)
+
+    async def main():
+        broadcaster.start()
+        broadcaster.publish([1, 2, 3, 4, 5], [("freed", gift(1))])
+        await asyncio.sleep(0.01)
+        assert [chat_id for chat_id, items in send.sent] == [3, 5]
+        # Chat 2's digest was put back after RetryAfter, and grows meanwhile
+        broadcaster.publish([2], [("added", gift(2))])
+        send.throttled.clear()
+        await broadcaster.stop(timeout=1)
+
+    asyncio.run(main())
+
+    # Chat 4's error didn't stop the others
+    assert [chat_id for chat_id, items in send.sent] == [3, 5, 1, 2]
+    assert send.sent[-1] == (2, [("freed", "gift0001"), ("added", "gift0002")])
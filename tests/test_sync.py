@@ -0,0 +1,108 @@
+"""Write-behind from the local store to a sheet that is edited by hand."""
+
+import asyncio
+
+from benchmarks.fakes import FakeWorksheet
+from sheets import AsyncSheet
+from storage import CellHeaders, SheetsStore, SQLiteStore
+from sync import SheetSync
+
+
+def setup(tmp_path, gifts=3):
+    worksheet = FakeWorksheet(gifts=gifts, ids=True)
+    sheet_api = AsyncSheet(worksheet=worksheet)
+    store = SQLiteStore(str(tmp_path / "wishlist.db"))
+    sync = SheetSync(
+        store,
+        sheet_api,
+        status_col=CellHeaders.status,
+        booker_col=CellHeaders.booker,
+        id_col=CellHeaders.gift_id,
+    )
+    return worksheet, SheetsStore(sheet_api), store, sync
+
+
+def gift_row(worksheet, gift_id):
+    for row in worksheet.rows:
+        if len(row) >= CellHeaders.gift_id and row[CellHeaders.gift_id - 1] == gift_id:
+            return row
+    return None
+
+
+def test_flush_follows_sorted_rows(tmp_path):
+    worksheet, sheets_store, store, sync = setup(tmp_path)
+
+    async def scenario():
+        store.import_gifts(await sheets_store.list_gifts())
+        assert (await store.book("gift0001", 1, "Alice"))[0]
+        # Someone reverse-sorts the sheet before the sync runs
+        worksheet.rows[1:] = worksheet.rows[:0:-1]
+        assert await sync.flush() == 1
+
+    asyncio.run(scenario())
+
+    assert gift_row(worksheet, "gift0001")[CellHeaders.status - 1] == "Alice"
+    assert gift_row(worksheet, "gift0001")[CellHeaders.booker - 1] == "1"
+    assert gift_row(worksheet, "gift0003")[CellHeaders.status - 1] == ""
+    assert store.pending_changes() == []
+    store.close()
+
+
+def test_flush_coalesces_by_gift(tmp_path):
+    worksheet, sheets_store, store, sync = setup(tmp_path)
+
+    async def scenario():
+        store.import_gifts(await sheets_store.list_gifts())
+        await store.book("gift0002", 1, "Alice")
+        await store.unbook("gift0002", 1, "Alice")
+        await store.book("gift0002", 2, "Bob")
+        worksheet.calls.clear()
+        assert await sync.flush() == 3
+
+    asyncio.run(scenario())
+
+    assert gift_row(worksheet, "gift0002")[CellHeaders.status - 1] == "Bob"
+    assert worksheet.calls == {"col_values": 1, "batch_update": 1}
+    store.close()
+
+
+def test_flush_skips_gifts_gone_from_the_sheet(tmp_path):
+    worksheet, sheets_store, store, sync = setup(tmp_path)
+
+    async def scenario():
+        store.import_gifts(await sheets_store.list_gifts())
+        await store.book("gift0002", 1, "Alice")
+        del worksheet.rows[2]
+        assert await sync.flush() == 1
+
+    asyncio.run(scenario())
+
+    assert all(not row[CellHeaders.status - 1] for row in worksheet.rows[1:])
+    assert store.pending_changes() == []
+    store.close()
+
+
+def test_gifts_deleted_in_the_sheet_go_locally(tmp_path):
+    worksheet, sheets_store, store, sync = setup(tmp_path)
+
+    async def scenario():
+        store.import_gifts(await sheets_store.list_gifts())
+        await store.book("gift0002", 1, "Alice")
+        # Gift 2 is deleted by hand, Gift 3 moves up into its row
+        del worksheet.rows[2]
+        store.import_gifts(await sheets_store.list_gifts())
+        assert [g["gift_id"] for g in await store.list_gifts()] == [
+            "gift0001",
+            "gift0003",
+        ]
+        assert await store.book("gift0002", 2, "Bob") == (False, None)
+        assert store.pending_changes() == []
+        assert (await store.book("gift0003", 2, "Bob"))[0]
+        await sync.flush()
+
+    asyncio.run(scenario())
+
+    assert worksheet.rows[2][CellHeaders.gift_id - 1] == "gift0003"
+    assert worksheet.rows[2][CellHeaders.status - 1] == "Bob"
+    assert worksheet.rows[1][CellHeaders.status - 1] == ""
+    store.close()
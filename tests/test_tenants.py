@@ -0,0 +1,70 @@
+"""WishlistPool opening, evicting and taking back wishlists."""
+
+import asyncio
+
+from tenants import WishlistPool
+
+
+class FakeWishlist:
+    def __init__(self, name):
+        self.name = name
+        self.started = self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    async def stop(self):
+        self.stopped = True
+
+
+def test_evicted_wishlist_is_taken_back_within_grace():
+    built = []
+
+    def factory(name):
+        built.append(FakeWishlist(name))
+        return built[-1]
+
+    async def scenario():
+        pool = WishlistPool(factory, max_size=1, grace=0.1)
+        first = pool.get("a")
+        pool.get("b")  # evicts "a"
+        assert "a" in pool and len(pool) == 1
+        assert pool.get("a") is first  # and now evicts "b"
+        await asyncio.sleep(0.2)
+        assert not first.stopped
+        assert built[1].stopped
+        # Past the grace period "b" is opened anew
+        assert pool.get("b") is not built[1]
+        await pool.close()
+        return first
+
+    first = asyncio.run(scenario())
+
+    assert [wishlist.name for wishlist in built] == ["a", "b", "b"]
+    assert first.stopped and all(wishlist.stopped for wishlist in built)
+
+
+def test_close_stops_retiring_wishlists():
+    async def scenario():
+        pool = WishlistPool(FakeWishlist, max_size=1, grace=30)
+        first = pool.get("a")
+        second = pool.get("b")
+        await pool.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first.stopped and second.stopped
+
+
+def test_discard_closes_right_away():
+    async def scenario():
+        pool = WishlistPool(FakeWishlist, max_size=4)
+        wishlist = pool.get("typo")
+        await pool.discard("typo")
+        return pool, wishlist
+
+    pool, wishlist = asyncio.run(scenario())
+
+    assert wishlist.stopped
+    assert "typo" not in pool
@@ -0,0 +1,116 @@
+"""Reading uploaded gift lists and exporting a wishlist."""
+
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from telegram import Chat, Document, Message, Update, User
+from telegram.ext import ApplicationBuilder
+
+from journal import BookingJournal
+from transfer import export_gifts, plan_import, read_entries
+
+
+def gift(number, **fields):
+    return {
+        "row": number + 1,
+        "gift_name": f"Gift {number}",
+        "price": str(100 * number),
+        "link": f"https://example.com/{number}",
+        "status": "",
+        "log": "",
+        "booker": "",
+        "gift_id": f"gift{number:04d}",
+        **fields,
+    }
+
+
+def test_plan_import_checks_names_and_links():
+    data = (
+        "назва,ціна,посилання\n"
+        "Gift 1,100,https://x\n"
+        "  Lego  набір ,1 200,https://shop.ua/l\n"
+        "lego набір,5,https://shop.ua/other\n"
+        "Без посилання,,\n"
+        ",5,https://a\n"
+        "Bad,1,ftp://x\n"
+        "IPv6,1,http://[::1\n"
+    ).encode("cp1251")
+
+    entries = read_entries(data, "gifts.csv")
+    rows, duplicates, invalid = plan_import(entries, [gift(1)])
+
+    assert [row[1] for row in rows] == ["Lego  набір"]
+    assert rows[0][3] == "https://shop.ua/l" and rows[0][7]
+    assert [entry["line"] for entry in duplicates] == [2, 4]
+    assert [(entry["line"], reason) for entry, reason in invalid] == [
+        (5, "немає посилання"),
+        (6, "немає назви"),
+        (7, "посилання має починатися з http:// або https://"),
+        (8, "посилання не читається"),
+    ]
+
+
+def test_export_includes_journal_history():
+    journal = BookingJournal(":memory:")
+    booked = gift(1, status="Ann", booker="1", log="before the journal")
+    journal.record("test", "book", booked, 2, "Bob")
+    journal.record("test", "unbook", booked, 2, "Bob")
+    journal.record("test", "book", booked, 1, "Ann")
+
+    def history(gift_id):
+        return journal.history("test", gift_id, limit=None)
+
+    gifts = [booked, gift(2)]
+    with export_gifts(gifts, "csv", history) as exported:
+        records = list(csv.DictReader(io.StringIO(exported.read().decode("utf-8-sig"))))
+    with export_gifts(gifts, "json", history) as exported:
+        items = json.load(exported)
+
+    assert records[0]["status"] == "Ann"
+    assert records[0]["log"] == "before the journal"
+    lines = records[0]["history"].splitlines()
+    assert [line.split()[2:] for line in lines] == [
+        ["book", "Bob", "(2)"],
+        ["unbook", "Bob", "(2)"],
+        ["book", "Ann", "(1)"],
+    ]
+    assert records[1]["history"] == ""
+    assert [event["action"] for event in items[0]["history"]] == [
+        "book",
+        "unbook",
+        "book",
+    ]
+    assert items[1]["history"] == []
+    # What was exported can be imported again, as duplicates
+    with export_gifts(gifts, "json", history) as exported:
+        entries = read_entries(exported.read(), "export.json")
+    assert plan_import(entries, gifts)[1] == entries
+
+
+def test_only_admins_files_reach_the_import(bot, monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_IDS", {42})
+    monkeypatch.setattr(bot, "PERSISTENCE_PATH", "")
+    app = bot.build_application(ApplicationBuilder().token("123:TEST"))
+
+    def handles(user_id, file_name):
+        message = Message(
+            message_id=1,
+            date=datetime.now(timezone.utc),
+            chat=Chat(-100, Chat.SUPERGROUP),
+            from_user=User(user_id, "Someone", False),
+            document=Document("file", "unique", file_name=file_name),
+        )
+        update = Update(1, message=message)
+        return [
+            handler.callback.__name__
+            for handler in app.handlers[0]
+            if handler.check_update(update)
+        ]
+
+    assert handles(42, "gifts.csv") == ["import_gifts"]
+    assert handles(42, "gifts.JSON") == ["import_gifts"]
+    # Nobody else gets an answer, in groups least of all
+    assert handles(7, "gifts.csv") == []
+    assert handles(42, "photo.png") == []
@@ -0,0 +1,207 @@
+import csv
+import io
+import json
+import tempfile
+from urllib.parse import urlsplit
+
+from storage import GIFT_FIELDS, CellHeaders, new_gift_id
+
+IMPORT_FIELDS = ("gift_name", "price", "link")
+
+# Journal events exported with each gift
+HISTORY_FIELDS = ("at", "action", "user_name", "user_id")
+
+# Column titles accepted in an uploaded file, besides the field names
+HEADER_ALIASES = {
+    "name": "gift_name",
+    "назва": "gift_name",
+    "подарунок": "gift_name",
+    "ціна": "price",
+    "url": "link",
+    "посилання": "link",
+}
+
+
+class BadImport(ValueError):
+    """The uploaded file can't be read as a list of gifts."""
+
+
+def _field(title):
+    title = str(title).strip().casefold()
+    return HEADER_ALIASES.get(title, title)
+
+
+def _decode(data):
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # What Excel saves Ukrainian CSVs in
+        return data.decode("cp1251")
+
+
+def _entry(line, values):
+    """An import entry from a dict of fields or a name, price, link sequence."""
+    if not isinstance(values, dict):
+        values = dict(zip(IMPORT_FIELDS, values))
+    entry = {"line": line}
+    for field in IMPORT_FIELDS:
+        value = values.get(field)
+        entry[field] = "" if value is None else str(value).strip()
+    return entry
+
+
+def _read_csv(text):
+    rows = csv.reader(io.StringIO(text, newline=""))
+    header = next(rows, [])
+    fields = [_field(title) for title in header]
+    if "gift_name" not in fields:
+        # No header: name, price and link in that order
+        fields = None
+        if any(cell.strip() for cell in header):
+            yield _entry(1, header)
+    for line, row in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        yield _entry(line, dict(zip(fields, row)) if fields else row)
+
+
+def _read_json(text):
+    try:
+        items = json.loads(text)
+    except ValueError as error:
+        raise BadImport(f"JSON: {error}") from None
+    if isinstance(items, dict):
+        items = items.get("gifts")
+    if not isinstance(items, list):
+        raise BadImport("JSON має бути списком подарунків")
+    for line, item in enumerate(items, start=1):
+        if isinstance(item, dict):
+            item = {_field(key): value for key, value in item.items()}
+        elif isinstance(item, str):
+            item = [item]
+        elif not isinstance(item, list):
+            raise BadImport(f"запис {line}: очікую об'єкт або список")
+        yield _entry(line, item)
+
+
+def read_entries(data, filename):
+    """Gifts in an uploaded CSV or JSON file, as dicts of ``IMPORT_FIELDS``.
+
+    Each entry also has the ``line`` (CSV) or position (JSON) it came from,
+    for error messages. Raises ``BadImport`` for unreadable files.
+    """
+    try:
+        text = _decode(bytes(data))
+    except UnicodeDecodeError:
+        raise BadImport("не вдалося прочитати кодування файлу") from None
+    if filename.lower().endswith(".json"):
+        return list(_read_json(text))
+    try:
+        return list(_read_csv(text))
+    except csv.Error as error:
+        raise BadImport(f"CSV: {error}") from None
+
+
+def name_key(name):
+    return " ".join(name.split()).casefold()
+
+
+def link_error(link):
+    """Why ``link`` is not acceptable, or ``None``."""
+    if not link:
+        # Every gift gets a button that opens its link
+        return "немає посилання"
+    try:
+        parts = urlsplit(link)
+    except ValueError:  # e.g. an unclosed [ of an IPv6 host
+        return "посилання не читається"
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return "посилання має починатися з http:// або https://"
+    if any(char.isspace() for char in link):
+        return "у посиланні є пробіли"
+    return None
+
+
+def plan_import(entries, gifts):
+    """Split ``entries`` into new sheet rows, duplicates and invalid entries.
+
+    ``gifts`` are the wishlist's current (cached) gifts; their names are read
+    once into a set, so every entry is checked against it, and against the
+    entries before it, without going back to the sheet. Returns ``(rows,
+    duplicates, invalid)``: rows ready for ``append_rows`` (with gift ids, so
+    the bot doesn't have to write them afterwards), the duplicate entries and
+    ``(entry, reason)`` pairs.
+    """
+    seen = {name_key(gift["gift_name"]) for gift in gifts}
+    rows, duplicates, invalid = [], [], []
+    for entry in entries:
+        key = name_key(entry["gift_name"])
+        if not key:
+            invalid.append((entry, "немає назви"))
+            continue
+        reason = link_error(entry["link"])
+        if reason:
+            invalid.append((entry, reason))
+            continue
+        if key in seen:
+            duplicates.append(entry)
+            continue
+        seen.add(key)
+        rows.append(sheet_row(entry))
+    return rows, duplicates, invalid
+
+
+def sheet_row(entry):
+    row = [""] * CellHeaders.gift_id
+    for field in IMPORT_FIELDS:
+        row[getattr(CellHeaders, field) - 1] = entry[field]
+    row[CellHeaders.gift_id - 1] = new_gift_id()
+    return row
+
+
+def history_line(event):
+    return f"{event['at']} {event['action']} {event['user_name']} ({event['user_id']})"
+
+
+def export_gifts(gifts, fmt="csv", history=None):
+    """Write ``gifts`` to a file object, ready to be sent as a document.
+
+    Besides the gift fields, which include the legacy ``log``, each gift gets
+    its ``history`` from the booking journal: ``history(gift_id)`` returns
+    its events, oldest first. In CSV they are one line per event.
+
+    Gifts are written one by one into a temporary file on disk, so the
+    serialized wishlist is not held in memory next to the rows it was made
+    from; the only full copy is the one read for the upload. The file is
+    rewound; the caller closes it, which deletes it.
+    """
+    # Named, since python-telegram-bot takes a file name from the object
+    out = tempfile.NamedTemporaryFile(suffix=f".{fmt}")
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    text = io.TextIOWrapper(out, encoding=encoding, newline="", write_through=True)
+    history = history or (lambda gift_id: [])
+    if fmt == "csv":
+        writer = csv.writer(text)
+        writer.writerow([*GIFT_FIELDS, "history"])
+        for gift in gifts:
+            events = history(gift["gift_id"])
+            writer.writerow(
+                [
+                    *(gift[field] for field in GIFT_FIELDS),
+                    "\n".join(history_line(event) for event in events),
+                ]
+            )
+    else:
+        separator = "[\n"
+        for gift in gifts:
+            record = {field: gift[field] for field in GIFT_FIELDS}
+            record["history"] = [
+                {field: event[field] for field in HISTORY_FIELDS}
+                for event in history(gift["gift_id"])
+            ]
+            text.write(separator + json.dumps(record, ensure_ascii=False))
+            separator = ",\n"
+        text.write("[]\n" if separator == "[\n" else "\n]\n")
+    text.detach()
+    out.seek(0)
+    return out